@@ -6,19 +6,49 @@ evaluates possible moves using a heuristic scoring system, and executes the best
 move via mouse automation. Waits for board animations to settle before each move.
 """
 
+import argparse
 import concurrent.futures
+import itertools
 import json
 import logging
 import os
 import time
 from datetime import datetime
-from functools import lru_cache
+from functools import lru_cache, partial
 
 import cv2
-import keyboard
-import mss
 import numpy as np
-import pyautogui
+
+import board
+import capture
+import polling
+import recognition
+import search
+import session
+import timing
+from board import (
+    BOTTOM_ROW_BONUS,
+    CASCADE_BASE_BONUS,
+    FLAME_MATCH_BONUS,
+    GRID_SIZE,
+    HYPERCUBE_SWAP_SCORE,
+    MATCH_WEIGHTS,
+    STAR_GEM_BONUS,
+    STAR_MATCH_BONUS,
+)
+from recognition import (
+    FLAME_HUE_STD_THRESHOLD,
+    HYPERCUBE_BORDER_S_THRESHOLD,
+    HYPERCUBE_BORDER_V_THRESHOLD,
+    MIN_COLOR_RATIO,
+    MIN_SATURATION,
+    MIN_VALUE,
+    SPECIAL_BORDER_V_THRESHOLD,
+    WHITE_MAX_SAT,
+    WHITE_MIN_VAL,
+    classify_hue,
+)
+from transposition import TranspositionTable
 
 try:
     import win32api
@@ -29,32 +59,52 @@ try:
 except ImportError:
     HAS_WIN32 = False
 
-_sct = mss.mss()
+try:
+    import keyboard
+
+    HAS_KEYBOARD = True
+except ImportError:
+    HAS_KEYBOARD = False
+
+try:
+    import pyautogui
+
+    HAS_PYAUTOGUI = True
+except ImportError:
+    HAS_PYAUTOGUI = False
+
+_frame_source = None  # capture.FrameSource behind capture_raw (live screen until set)
 _thread_pool = concurrent.futures.ThreadPoolExecutor()
+_frame_differ = recognition.FrameDiffer()  # Shared by the stability and double-scan checks
+_capture_thread = None  # capture.CaptureThread serving capture_raw, if started
+_capture_seq = -1  # Sequence number of the last frame capture_raw took from it
+_poll_frames = [None, None]  # Reused (prev, curr) frames of wait_for_stable_board
+_select_frames = [None, None]  # Reused (before, after) cell grabs of _wait_for_select
 
-GRID_SIZE = 8
-
-# HSV hue ranges for gem classification (OpenCV: H=0-179)
-# Red wraps around 0/179, handled separately in classify_hue
-GEM_HUE_RANGES = [
-    (8, 20, "orange"),
-    (20, 35, "yellow"),
-    (35, 85, "green"),
-    (85, 125, "blue"),
-    (125, 170, "purple"),
-]
-
-# HSV thresholds for pixel filtering
-MIN_SATURATION = 80
-MIN_VALUE = 80
-WHITE_MAX_SAT = 50
-WHITE_MIN_VAL = 180
-MIN_COLOR_RATIO = 0.10  # At least 10% of center region must be colorful
+# Grab the grid on a background thread (capture.py) instead of in capture_raw
+CAPTURE_THREAD = True
+
+# Recognition path: "vectorized" = whole-grid NumPy reductions (recognition.py),
+# "subsampled" = the same on a fixed SUBSAMPLE_SIDE^2 pixel sample per cell,
+# "threaded" = one identify_cell_color task per cell on _thread_pool
+RECOGNITION_MODE = "vectorized"
+
+# Incremental recognition: re-classify only cells whose pixels changed since
+# they were last classified and reuse the labels of the rest
+INCREMENTAL_RECOGNITION = True
+INCREMENTAL_MAX_CHANGED = 32  # More changed cells than this: re-classify the whole grid
 
 # Board stability detection
 STABILITY_THRESHOLD = 3.0  # Max mean pixel difference to consider board stable
 STABILITY_DELAY = 0.15  # Seconds between stability checks
 MAX_STABILITY_WAIT = 5.0  # Maximum seconds to wait for board to settle
+PARTIAL_STABILITY = True  # Act on a partly animating board, keeping moves off moving cells
+MIN_SETTLED_CELLS = 40  # Settled cells (of 64) needed before acting on a partly animating board
+
+# Adaptive polling (polling.py): learn settle times per event type and poll on
+# that schedule instead of every STABILITY_DELAY; logs latency histograms
+ADAPTIVE_POLLING = True
+CLICK_DELAY = 0.1  # Max seconds between the two clicks of a swap
 
 # Minimum identified cells to trust a frame (out of 64)
 MIN_IDENTIFIED_CELLS = 56
@@ -65,16 +115,27 @@ MAX_SINGLE_COLOR_RATIO = 0.55
 # Minimum number of distinct colors for a valid game board
 MIN_DISTINCT_COLORS = 4
 
-# Special gem detection thresholds (calibrated from gem_library captures)
-SPECIAL_BORDER_V_THRESHOLD = 130  # Regular max 104, special min 140 (raised from 120 to avoid hint glow)
-HYPERCUBE_BORDER_V_THRESHOLD = 150  # Hypercube 166, hint glow ~125-145 (extra check to prevent false positives)
-HYPERCUBE_BORDER_S_THRESHOLD = 90  # Hypercube 73, next lowest 102
-FLAME_HUE_STD_THRESHOLD = 35  # Flame min 43, star max 30
+# Move search engine: "search" = N-ply iterative deepening (search.py),
+# "numpy" = fixed 2-step look-ahead on the integer board engine (board.py),
+# "list" = the original nested-list simulator below,
+# "compare" = run "list" and "numpy" and log mismatches (needs
+# board.SPECIAL_RULES = False and board.HYPERCUBE_SIMULATE = False: the list
+# simulator has no special gem rules)
+SIM_ENGINE = "search"
+
+# Expectimax refill model for the "search" engine: None = cleared cells stay
+# empty, "uniform" = refills drawn evenly from all colors, "observed" = refills
+# follow the color frequencies of the current board
+REFILL_MODE = None
+
+# Worker processes for the "search" engine (0 = search in the main process)
+SEARCH_WORKERS = 0
 
-# Bonus scores for moves involving special gems
-HYPERCUBE_SWAP_SCORE = 1  # Last resort: save hypercubes until no other moves exist
-FLAME_MATCH_BONUS = 200  # 3x3 explosion (~8 extra gems)
-STAR_MATCH_BONUS = 400  # Cross detonation (~14 extra gems)
+# Pipelined search ("search" engine without workers): a background planner
+# starts searching each grid as soon as it is recognized, overlapping the
+# stability wait and the double-scan; the move is committed once the board
+# is confirmed stable, and the plan is cancelled if the board changed
+PIPELINED_SEARCH = True
 
 # Single-letter abbreviations for log output
 COLOR_ABBREV = {
@@ -219,21 +280,79 @@ def get_grid_coordinates():
     return top_left, bottom_right
 
 
-def capture_raw(top_left, bottom_right):
-    """Capture a raw screenshot of the grid region."""
+def start_capture(top_left, bottom_right):
+    """(Re)start the background capture thread for the grid region."""
+    global _capture_thread, _capture_seq
+    stop_capture()
+    _capture_thread = capture.CaptureThread(top_left, bottom_right).start()
+    _capture_seq = -1
+    return _capture_thread
+
+
+def stop_capture():
+    """Stop the background capture thread, if running. Returns its stats string."""
+    global _capture_thread
+    if _capture_thread is None:
+        return None
+    _capture_thread.stop()
+    stats = _capture_thread.stats()
+    _capture_thread = None
+    return stats
+
+
+def set_frame_source(source):
+    """Serve capture_raw from source (a capture.FrameSource) from now on."""
+    global _frame_source
+    _frame_source = source
+
+
+def frame_source():
+    """The active frame source, opening the live screen on first use."""
+    if _frame_source is None:
+        set_frame_source(capture.ScreenSource())
+    return _frame_source
+
+
+def key_pressed(key):
+    """keyboard.is_pressed, always False on replays or without the keyboard package."""
+    return HAS_KEYBOARD and frame_source().live and keyboard.is_pressed(key)
+
+
+def capture_raw(top_left, bottom_right, out=None):
+    """Capture a raw screenshot of the grid region.
+
+    Served from the background capture thread when one is running for this
+    region, else from the active frame source (a replay returns its current
+    recorded frame). The thread serves its newest frame, waiting for one
+    grabbed after the frame this returned last, so back-to-back polls never
+    compare a frame with itself; if the thread died or stalled it is
+    restarted once.
+    out: optional BGR frame from an earlier call to overwrite instead of
+    allocating a new one.
+    """
+    global _capture_seq
+    if _capture_thread is not None and _capture_thread.matches(top_left, bottom_right):
+        try:
+            frame, _, _capture_seq = _capture_thread.latest(out, _capture_seq)
+        except (RuntimeError, TimeoutError) as exc:
+            logging.getLogger("bejeweled").warning("%s, restarting capture", exc)
+            start_capture(top_left, bottom_right)
+            frame, _, _capture_seq = _capture_thread.latest(out, _capture_seq)
+        return frame
     region = {
         "left": top_left[0],
         "top": top_left[1],
         "width": bottom_right[0] - top_left[0],
         "height": bottom_right[1] - top_left[1],
     }
-    return cv2.cvtColor(np.array(_sct.grab(region)), cv2.COLOR_BGRA2BGR)
+    return frame_source().grab(region, out)
 
 
-def add_grid_overlay(grid_img):
+def add_grid_overlay(grid_img, geometry=None):
     """Draw green grid lines on an image for visual feedback. Modifies in place."""
-    cell_width = grid_img.shape[1] // GRID_SIZE
-    cell_height = grid_img.shape[0] // GRID_SIZE
+    geometry = geometry or recognition.image_geometry(grid_img)
+    cell_width = geometry.cell_w
+    cell_height = geometry.cell_h
     for i in range(1, GRID_SIZE):
         cv2.line(
             grid_img,
@@ -252,25 +371,75 @@ def add_grid_overlay(grid_img):
     return grid_img
 
 
-def wait_for_stable_board(top_left, bottom_right, logger):
-    """Wait until the board stops animating by comparing consecutive frames."""
-    prev_frame = capture_raw(top_left, bottom_right)
-    start = time.time()
+def wait_for_stable_board(top_left, bottom_right, logger, settle_model=None, event=None,
+                          since=None, on_frame=None):
+    """Wait until the board stops animating by comparing consecutive frames.
 
-    while time.time() - start < MAX_STABILITY_WAIT:
-        time.sleep(STABILITY_DELAY)
-        curr_frame = capture_raw(top_left, bottom_right)
-        diff = np.mean(np.abs(curr_frame.astype(float) - prev_frame.astype(float)))
+    Returns the motion map: an (8, 8) bool array, True where a cell is
+    settled. Once the whole frame is stable every cell counts as settled.
+    With PARTIAL_STABILITY the wait also ends as soon as MIN_SETTLED_CELLS
+    cells have stopped moving (say, only a flame flickers in one corner);
+    the caller then keeps moves away from the animating cells
+    (board.unsettled_moves).
+
+    settle_model: optional polling.SettleModel. Given the event the last move
+    was expected to trigger (polling.event_type) and since, when its clicks
+    finished, the first frame is taken after the learned settle time and
+    later polls follow the model's schedule. The measured wait is fed back
+    when the whole frame settled (not on a partial settle).
+    Without an event, polls every STABILITY_DELAY.
+
+    on_frame: optional callback given each frame captured while the board
+    still animates (the pipelined planner starts on it before the next poll).
+    """
+    all_settled = np.ones((GRID_SIZE, GRID_SIZE), dtype=bool)
+    if settle_model is not None and event is not None:
+        first_delay, intervals = settle_model.schedule(event)
+        time.sleep(max(0.0, since + first_delay - time.time()))
+    else:
+        settle_model = None
+        intervals = itertools.repeat(STABILITY_DELAY)
 
+    frames = _poll_frames  # [prev, curr], swapped after each poll
+    frames[0] = prev_frame = capture_raw(top_left, bottom_right, frames[0])
+    start = prev_time = time.time()
+    last_motion = None
+
+    while time.time() - start < MAX_STABILITY_WAIT:
+        time.sleep(next(intervals))
+        frames[1] = curr_frame = capture_raw(top_left, bottom_right, frames[1])
+        curr_time = time.time()
+        motion = _frame_differ.cell_motion(prev_frame, curr_frame)
+        diff = float(motion.mean())
+
+        settled = motion < STABILITY_THRESHOLD
+        n_settled = int(np.count_nonzero(settled))
         if diff < STABILITY_THRESHOLD:
             logger.debug("Board stable (diff=%.2f)", diff)
-            return True
+            settled = all_settled
+        elif PARTIAL_STABILITY and n_settled >= MIN_SETTLED_CELLS:
+            logger.debug(
+                "Board partly stable (diff=%.2f, %d/%d cells settled)",
+                diff,
+                n_settled,
+                GRID_SIZE * GRID_SIZE,
+            )
+        else:
+            logger.debug("Board animating (diff=%.2f), waiting...", diff)
+            if on_frame is not None:
+                on_frame(curr_frame)
+            prev_frame, prev_time, last_motion = curr_frame, curr_time, curr_time
+            frames.reverse()
+            continue
 
-        logger.debug("Board animating (diff=%.2f), waiting...", diff)
-        prev_frame = curr_frame
+        # A partial settle is not the event's settle time; feeding it back
+        # would pull the learned schedule too early
+        if settle_model is not None and settled is all_settled:
+            settle_model.record(event, since, last_motion, prev_time, time.time())
+        return settled
 
     logger.warning("Board stability timeout after %.1fs", MAX_STABILITY_WAIT)
-    return False
+    return all_settled
 
 
 @lru_cache(maxsize=32)
@@ -281,16 +450,7 @@ def gem_base_color(gem_name):
     return gem_name.split("_")[0]
 
 
-def classify_hue(hue):
-    """Classify an HSV hue value into a gem color name."""
-    if hue < 8 or hue >= 170:
-        return "red"
-    for low, high, name in GEM_HUE_RANGES:
-        if low <= hue < high:
-            return name
-
-
-def classify_special(cell_hsv):
+def classify_special(cell_hsv, geometry=None):
     """Classify a gem cell as regular, flame, star, or hypercube.
 
     Expects a pre-computed HSV cell image. Analyzes the border region
@@ -299,13 +459,18 @@ def classify_special(cell_hsv):
     - Flame gems have bright, saturated orange/yellow fire aura
     - Star gems have bright, desaturated white/blue glow
     - Hypercube has bright border with low saturation (multicolor metallic)
+    geometry: GridGeometry whose cells match cell_hsv; supplies the
+    precomputed border mask so nothing is allocated per cell.
     """
     h, s, v = cell_hsv[:, :, 0], cell_hsv[:, :, 1], cell_hsv[:, :, 2]
     cell_h, cell_w = cell_hsv.shape[:2]
 
     # Border = outer ring (everything outside center 50%)
-    border_mask = np.ones((cell_h, cell_w), dtype=bool)
-    border_mask[cell_h // 4 : cell_h * 3 // 4, cell_w // 4 : cell_w * 3 // 4] = False
+    if geometry is not None and (geometry.cell_h, geometry.cell_w) == (cell_h, cell_w):
+        border_mask = geometry.border_mask
+    else:
+        border_mask = np.ones((cell_h, cell_w), dtype=bool)
+        border_mask[cell_h // 4 : cell_h * 3 // 4, cell_w // 4 : cell_w * 3 // 4] = False
 
     border_v = float(np.mean(v[border_mask]))
 
@@ -343,34 +508,28 @@ def classify_special(cell_hsv):
 _unknown_gem_timestamps = {}  # Throttle: track last save time per cell
 
 
-def identify_cell_color(grid_img, grid_hsv, row, col, save_unknowns=False):
+def identify_cell_color(grid_img, grid_hsv, row, col, save_unknowns=False, geometry=None):
     """Identify gem color and special type. Returns (row, col, gem_name).
 
     gem_name is one of: 'red', 'blue', ..., 'red_flame', 'blue_star', 'hypercube', or ''.
     grid_hsv: pre-computed HSV image of the entire grid (avoids redundant conversions).
     save_unknowns: if True, save unidentified cells to unknown_gems/ for review.
+    geometry: cached GridGeometry for this capture (looked up from the image size if omitted).
     """
-    cell_width = grid_img.shape[1] // GRID_SIZE
-    cell_height = grid_img.shape[0] // GRID_SIZE
+    geometry = geometry or recognition.image_geometry(grid_img)
 
     # Full cell HSV for special gem detection (from pre-computed HSV)
-    full_cell_hsv = grid_hsv[
-        row * cell_height : (row + 1) * cell_height,
-        col * cell_width : (col + 1) * cell_width,
-    ]
+    full_cell_hsv = geometry.cell(grid_hsv, row, col)
 
     # Check for special gem type (uses border glow analysis)
-    special = classify_special(full_cell_hsv)
+    special = classify_special(full_cell_hsv, geometry)
 
     # Hypercube has no base color — return immediately
     if special == "hypercube":
         return row, col, "hypercube"
 
     # Center 50% from pre-computed HSV (no second cvtColor call)
-    center_hsv = full_cell_hsv[
-        cell_height // 4 : cell_height - cell_height // 4,
-        cell_width // 4 : cell_width - cell_width // 4,
-    ]
+    center_hsv = full_cell_hsv[geometry.color_center]
 
     h, s, v = center_hsv[:, :, 0], center_hsv[:, :, 1], center_hsv[:, :, 2]
     total_pixels = h.size
@@ -402,10 +561,7 @@ def identify_cell_color(grid_img, grid_hsv, row, col, save_unknowns=False):
                 unknown_dir = os.path.join(os.path.dirname(__file__) or ".", "unknown_gems")
                 os.makedirs(unknown_dir, exist_ok=True)
                 ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                full_cell = grid_img[
-                    row * cell_height : (row + 1) * cell_height,
-                    col * cell_width : (col + 1) * cell_width,
-                ]
+                full_cell = geometry.cell(grid_img, row, col)
                 cv2.imwrite(os.path.join(unknown_dir, f"r{row}_c{col}_{ts}.png"), full_cell)
         return row, col, ""
 
@@ -418,14 +574,13 @@ def identify_cell_color(grid_img, grid_hsv, row, col, save_unknowns=False):
 _library_saved = set()  # Track which (color, hue) combos we've already saved
 
 
-def save_gem_library(grid_img, color_grid):
+def save_gem_library(grid_img, color_grid, geometry=None):
     """Save one example screenshot per unique gem type encountered.
 
     Saves to gem_library/<color>/ folders. Only saves new types not yet
     in the library, so it builds up over time without duplicates.
     """
-    cell_w = grid_img.shape[1] // GRID_SIZE
-    cell_h = grid_img.shape[0] // GRID_SIZE
+    geometry = geometry or recognition.image_geometry(grid_img)
 
     for row in range(GRID_SIZE):
         for col in range(GRID_SIZE):
@@ -443,25 +598,50 @@ def save_gem_library(grid_img, color_grid):
             )
             os.makedirs(color_dir, exist_ok=True)
 
-            full_cell = grid_img[
-                row * cell_h : (row + 1) * cell_h,
-                col * cell_w : (col + 1) * cell_w,
-            ]
+            full_cell = geometry.cell(grid_img, row, col)
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             cv2.imwrite(os.path.join(color_dir, f"{color}_{ts}.png"), full_cell)
 
 
-def build_color_grid(grid_img, save_unknowns=False):
-    """Identify colors for all cells in parallel. Returns (color_grid, grid_hsv).
+def build_color_grid(grid_img, save_unknowns=False, geometry=None, hsv_out=None):
+    """Identify colors for all cells. Returns (color_grid, grid_hsv).
 
     Converts the grid image to HSV once and reuses it for all 64 cells,
-    avoiding redundant per-cell cvtColor calls.
+    avoiding redundant per-cell cvtColor calls. RECOGNITION_MODE selects the
+    whole-grid vectorized classifier or one thread pool task per cell; both
+    give the same labels. The "subsampled" mode converts and classifies only
+    a strided sample of each cell (run recognition.py for its accuracy against
+    the reviewed gem_library); its grid_hsv is the full-resolution HSV only
+    when unknowns are saved, otherwise the sample. hsv_out: optional HSV
+    frame from an earlier call to convert into instead of allocating.
     """
-    grid_hsv = cv2.cvtColor(grid_img, cv2.COLOR_BGR2HSV)
+    geometry = geometry or recognition.image_geometry(grid_img)
+    if RECOGNITION_MODE == "subsampled":
+        color_grid, sample_hsv = recognition.classify_subsampled(grid_img)
+        if not save_unknowns:
+            return color_grid, sample_hsv
+        grid_hsv = capture.convert_into(grid_img, cv2.COLOR_BGR2HSV, hsv_out, "hsv")
+    else:
+        grid_hsv = capture.convert_into(grid_img, cv2.COLOR_BGR2HSV, hsv_out, "hsv")
+        if RECOGNITION_MODE == "vectorized":
+            color_grid = recognition.classify_cells(grid_hsv, geometry)
+
+    if RECOGNITION_MODE in ("vectorized", "subsampled"):
+        if save_unknowns:
+            for row in range(GRID_SIZE):
+                for col in range(GRID_SIZE):
+                    if not color_grid[row][col]:
+                        identify_cell_color(
+                            grid_img, grid_hsv, row, col, save_unknowns=True, geometry=geometry
+                        )
+        return color_grid, grid_hsv
+
     color_grid = [["" for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
 
     futures = [
-        _thread_pool.submit(identify_cell_color, grid_img, grid_hsv, row, col, save_unknowns)
+        _thread_pool.submit(
+            identify_cell_color, grid_img, grid_hsv, row, col, save_unknowns, geometry
+        )
         for row in range(GRID_SIZE)
         for col in range(GRID_SIZE)
     ]
@@ -472,6 +652,45 @@ def build_color_grid(grid_img, save_unknowns=False):
     return color_grid, grid_hsv
 
 
+def update_color_grid(grid_img, tracker, geometry=None):
+    """Re-classify only the cells that changed since the last frame.
+
+    Returns (color_grid, grid_hsv, reclassified). Falls back to
+    build_color_grid when nothing is cached or more than
+    INCREMENTAL_MAX_CHANGED cells changed. Otherwise each changed cell gets
+    its own HSV conversion, written into the cached grid_hsv so it stays
+    current, and goes through identify_cell_color (same labels as the
+    whole-grid path). In "subsampled" mode this works on the sample.
+    """
+    changed, signatures = tracker.changed_cells(grid_img)
+    reclassified = int(np.count_nonzero(changed))
+    if tracker.color_grid is None or reclassified > INCREMENTAL_MAX_CHANGED:
+        color_grid, grid_hsv = build_color_grid(
+            grid_img, geometry=geometry, hsv_out=tracker.grid_hsv
+        )
+        changed[:] = True
+        tracker.update(changed, signatures, color_grid, grid_hsv)
+        return color_grid, grid_hsv, GRID_SIZE * GRID_SIZE
+
+    if RECOGNITION_MODE == "subsampled":
+        grid_img = recognition.subsample_grid(grid_img)
+        geometry = recognition.image_geometry(grid_img)
+    else:
+        geometry = geometry or recognition.image_geometry(grid_img)
+
+    color_grid = [row[:] for row in tracker.color_grid]
+    grid_hsv = tracker.grid_hsv
+    for row, col in zip(*np.nonzero(changed)):
+        row, col = int(row), int(col)
+        cell = geometry.cell_slices[row][col]
+        grid_hsv[cell] = cv2.cvtColor(grid_img[cell], cv2.COLOR_BGR2HSV)
+        color_grid[row][col] = identify_cell_color(
+            grid_img, grid_hsv, row, col, geometry=geometry
+        )[2]
+    tracker.update(changed, signatures, color_grid, grid_hsv)
+    return color_grid, grid_hsv, reclassified
+
+
 def is_valid_board(color_grid):
     """Check if the color grid looks like a real game board, not a popup or menu."""
     color_counts = {}
@@ -498,13 +717,6 @@ def is_valid_board(color_grid):
     return True, ""
 
 
-# Heuristic scoring weights (loosely based on Bejeweled 3 point values)
-MATCH_WEIGHTS = {3: 50, 4: 100, 5: 500}  # 4=Flame Gem, 5=Hypercube
-STAR_GEM_BONUS = 150  # L/T match creating a Star Gem
-CASCADE_BASE_BONUS = 50  # Increases by 50 per cascade level
-BOTTOM_ROW_BONUS = 2  # Small tiebreaker per row toward bottom
-
-
 def find_matches(grid):
     """Find all matches on the grid. Returns list of (row, col, length, direction).
 
@@ -848,6 +1060,83 @@ def find_optimal_move(color_grid, failed_moves=None):
     return best_move, best_score
 
 
+def refill_model(color_grid):
+    """RefillModel selected by REFILL_MODE for a grid (None = no refills)."""
+    if REFILL_MODE == "uniform":
+        return search.RefillModel()
+    if REFILL_MODE == "observed":
+        return search.RefillModel.from_board(board.encode_grid(color_grid))
+    return None
+
+
+def choose_move(color_grid, failed_moves, logger, table=None, parallel=None, planner=None):
+    """Find the best move using the engine selected by SIM_ENGINE.
+
+    In "compare" mode both engines run on the same grid and any disagreement
+    is logged, so the integer engine can be checked against the list engine
+    during a live session. The list engine's answer is used in that mode.
+    table: TranspositionTable for the integer engine (kept for the whole game).
+    parallel: optional search.ParallelSearch process pool for the "search" engine.
+    planner: optional search.Planner; the grid's plan is committed (started
+    first if the planner was not already working on it).
+    """
+    if SIM_ENGINE == "search":
+        if planner:
+            root = board.encode_grid(color_grid)
+            planner.submit(root, failed_moves, table, refill_model(color_grid))
+            result = planner.commit(root, failed_moves)
+        else:
+            search_fn = parallel.search_move if parallel else search.search_move
+            result = search_fn(color_grid, failed_moves, table, refill=refill_model(color_grid))
+        logger.debug(
+            "Search: depth %d, %d nodes, %.1fms",
+            result.depth, result.nodes, result.elapsed_ms,
+        )
+        return result.move, result.score
+    if SIM_ENGINE == "list":
+        return find_optimal_move(color_grid, failed_moves)
+    if SIM_ENGINE == "numpy":
+        return board.find_optimal_move(color_grid, failed_moves, table)
+
+    list_start = time.perf_counter()
+    result = find_optimal_move(color_grid, failed_moves)
+    list_ms = (time.perf_counter() - list_start) * 1000
+    numpy_start = time.perf_counter()
+    numpy_result = board.find_optimal_move(color_grid, failed_moves, table)
+    numpy_ms = (time.perf_counter() - numpy_start) * 1000
+    if numpy_result != result:
+        logger.warning("Engine mismatch: list=%s numpy=%s", result, numpy_result)
+    logger.debug("Move search: list %.1fms, numpy %.1fms", list_ms, numpy_ms)
+    return result
+
+
+def plan_provisional(frame, planner, tracker, geometry, failed_moves, table):
+    """Start planning the grid of a frame captured while the board still animates.
+
+    Frames with an unidentified cell or that don't look like a game board
+    are skipped. Recognition goes through the incremental tracker, so cells
+    classified here need not be classified again once the board settles.
+    """
+    if INCREMENTAL_RECOGNITION:
+        color_grid = update_color_grid(frame, tracker, geometry)[0]
+    else:
+        color_grid = build_color_grid(frame, geometry=geometry)[0]
+    if not all(all(row) for row in color_grid) or not is_valid_board(color_grid)[0]:
+        return
+    planner.submit(board.encode_grid(color_grid), failed_moves, table, refill_model(color_grid))
+
+
+def double_scan(top_left, bottom_right, frame, out=None):
+    """Re-capture the grid STABILITY_DELAY after frame. Returns (new_frame, motion).
+
+    motion is the per-cell difference between the two frames
+    (FrameDiffer.cell_motion). out: optional buffer for the new frame.
+    """
+    time.sleep(STABILITY_DELAY)
+    out = capture_raw(top_left, bottom_right, out)
+    return out, _frame_differ.cell_motion(frame, out)
+
+
 def _send_click(hwnd, screen_x, screen_y):
     """Send a mouse click to a window without moving the physical mouse."""
     client_x, client_y = win32gui.ScreenToClient(hwnd, (screen_x, screen_y))
@@ -856,55 +1145,145 @@ def _send_click(hwnd, screen_x, screen_y):
     win32gui.SendMessage(hwnd, win32con.WM_LBUTTONUP, 0, lparam)
 
 
-def perform_move(top_left, bottom_right, src_row, src_col, dest_row, dest_col, hwnd=None):
+def _wait_for_select(geometry, row, col, before, settle_model):
+    """Poll one cell until its selection highlight shows, at most CLICK_DELAY seconds."""
+    cell_tl, cell_br = geometry.cell_box(row, col)
+    start = time.time()
+    while time.time() - start < CLICK_DELAY:
+        time.sleep(polling.POLL_MIN_INTERVAL)
+        _select_frames[1] = after = capture_raw(cell_tl, cell_br, _select_frames[1])
+        if cv2.norm(after, before, cv2.NORM_L1) / after.size >= STABILITY_THRESHOLD:
+            break
+    settle_model.record_latency("select", time.time() - start, CLICK_DELAY)
+
+
+def perform_move(top_left, bottom_right, src_row, src_col, dest_row, dest_col, hwnd=None,
+                 geometry=None, settle_model=None):
     """Click the source and destination cells to perform a gem swap.
 
     Uses screen coordinates (not image pixels) to avoid DPI scaling mismatches.
     If hwnd is provided, sends clicks via SendMessage (doesn't move the mouse).
+    geometry: cached GridGeometry holding the precomputed click centers.
+    settle_model: optional polling.SettleModel; the second click then follows
+    as soon as the first cell shows its selection highlight instead of after
+    a fixed CLICK_DELAY.
     """
-    cell_width = (bottom_right[0] - top_left[0]) / GRID_SIZE
-    cell_height = (bottom_right[1] - top_left[1]) / GRID_SIZE
-
-    from_pos = (
-        int(top_left[0] + src_col * cell_width + cell_width / 2),
-        int(top_left[1] + src_row * cell_height + cell_height / 2),
-    )
-    to_pos = (
-        int(top_left[0] + dest_col * cell_width + cell_width / 2),
-        int(top_left[1] + dest_row * cell_height + cell_height / 2),
-    )
+    geometry = geometry or recognition.grid_geometry(tuple(top_left), tuple(bottom_right))
+    from_pos = geometry.click_centers[src_row][src_col]
+    to_pos = geometry.click_centers[dest_row][dest_col]
+    if settle_model is not None:
+        _select_frames[0] = before = capture_raw(
+            *geometry.cell_box(src_row, src_col), _select_frames[0]
+        )
 
     if hwnd:
         _send_click(hwnd, *from_pos)
-        time.sleep(0.1)
-        _send_click(hwnd, *to_pos)
     else:
         pyautogui.click(from_pos)
-        time.sleep(0.1)
+
+    if settle_model is not None:
+        _wait_for_select(geometry, src_row, src_col, before, settle_model)
+    else:
+        time.sleep(CLICK_DELAY)
+
+    if hwnd:
+        _send_click(hwnd, *to_pos)
+    else:
         pyautogui.click(to_pos)
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bejeweled 3 bot")
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="play back recorded frames (a directory of PNGs or a packed .npz session) "
+        "instead of the screen: no window, keys or clicks",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0.0,
+        help="replay pace relative to the recording (0 = as fast as possible)",
+    )
+    parser.add_argument("--headless", action="store_true", help="don't show the overlay window")
+    parser.add_argument(
+        "--record-dir",
+        metavar="DIR",
+        help="save every scanned frame as a PNG (replayable with --replay)",
+    )
+    parser.add_argument(
+        "--session",
+        metavar="PATH",
+        help=f"record frames, grids, moves and stage timings to a session file "
+        f"(*{session.SESSION_EXT}, readable with session.py and --replay)",
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="PATH",
+        help="dump per-frame stage timings to a .csv or .jsonl file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=int,
+        default=0,
+        metavar="N",
+        help=f"cProfile the first N frames into {timing.PROFILE_DIR}/ "
+        f"(press O any time to profile the next {timing.PROFILE_FRAMES})",
+    )
+    parser.add_argument(
+        "--max-frames", type=int, default=0, help="stop after this many scanned frames"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     logger = setup_logger()
     logger.info("BejeweledBot started (Bejeweled 3)")
 
-    # Try auto-detection, fall back to manual calibration
-    coords = find_grid_from_window(logger)
-    if coords:
-        top_left, bottom_right, hwnd = coords
+    source = capture.open_source(args.replay, args.speed)
+    set_frame_source(source)
+    show_overlay = source.live and not args.headless
+    if args.record_dir:
+        os.makedirs(args.record_dir, exist_ok=True)
+    session_writer = session.SessionWriter(args.session) if args.session else None
+    timer = timing.StageTimer(args.timings)
+    profiler = timing.FrameProfiler()
+
+    if not source.live:
+        # Recorded frames show just the grid
+        width, height = source.frame_size()
+        top_left, bottom_right, hwnd = (0, 0), (width, height), None
+        logger.info(
+            "Replaying %s: %d frames at %s",
+            args.replay,
+            len(source),
+            f"{args.speed:g}x" if args.speed else "full speed",
+        )
     else:
-        logger.info("Auto-detect unavailable, using manual calibration")
-        top_left, bottom_right = get_grid_coordinates()
-        hwnd = None
+        # Try auto-detection, fall back to manual calibration
+        coords = find_grid_from_window(logger)
+        if coords:
+            top_left, bottom_right, hwnd = coords
+        else:
+            logger.info("Auto-detect unavailable, using manual calibration")
+            top_left, bottom_right = get_grid_coordinates()
+            hwnd = None
 
-    if hwnd:
-        logger.info("Using SendMessage for clicks (mouse stays free)")
-    else:
-        logger.info("Using pyautogui for clicks (mouse will be controlled)")
+        if hwnd:
+            logger.info("Using SendMessage for clicks (mouse stays free)")
+        else:
+            logger.info("Using pyautogui for clicks (mouse will be controlled)")
 
     logger.info(
         "Grid coordinates: top-left=%s, bottom-right=%s", top_left, bottom_right
     )
+    # Cell slices, masks and click centers; rebuilt only when the grid moves
+    geometry = recognition.grid_geometry(tuple(top_left), tuple(bottom_right))
+    use_capture_thread = CAPTURE_THREAD and source.live
+    if use_capture_thread:
+        start_capture(top_left, bottom_right)
 
     last_move = None
     move_count = 0
@@ -915,38 +1294,129 @@ def main():
     move_history = []  # Track recent moves to detect stuck loops
     failed_moves = set()  # Moves to skip (tried repeatedly without effect)
     prev_grid_state = None  # Track board state to clear blacklist on change
+    transposition_table = TranspositionTable()  # Search cache, reset each game
+    recognition_tracker = recognition.CellChangeTracker()  # Labels reused across frames
+    settle_model = None
+    if ADAPTIVE_POLLING and source.live:
+        settle_model = polling.SettleModel(STABILITY_DELAY)
+    pending_event = (None, None)  # (event type, time) of the last move, for adaptive polling
+    # Frame buffers reused every iteration (no frame-size allocation per scan)
+    raw_image = raw_image2 = display_image = grid_hsv = None
+    frames_scanned = 0
+    record = None  # Session record of the last scan, written once its move is known
+    parallel_search = None
+    if SIM_ENGINE == "search" and SEARCH_WORKERS > 0:
+        parallel_search = search.ParallelSearch(SEARCH_WORKERS)
+        logger.info("Parallel search with %d worker processes", parallel_search.workers)
+    planner = None
+    if SIM_ENGINE == "search" and PIPELINED_SEARCH and not parallel_search:
+        planner = search.Planner(profiler)
+        logger.info("Pipelined search: planning overlaps the stability wait and double-scan")
 
     logger.info("Game #%d started", game_number)
 
-    while not keyboard.is_pressed("esc"):
-        # Wait for animations to finish before scanning
-        wait_for_stable_board(top_left, bottom_right, logger)
-
-        raw_image = capture_raw(top_left, bottom_right)
-        color_grid, grid_hsv = build_color_grid(raw_image)
+    while not key_pressed("esc"):
+        if record:
+            session_writer.append(**record)
+            record = None
+        timer.new_frame()
+        summary = timer.periodic_summary(move_count)
+        if summary:
+            logger.info("Timing: %s", summary)
+        profile_path = profiler.frame_done()
+        if profile_path:
+            logger.info("Profile saved: %s", profile_path)
+        # O (or --profile at startup): cProfile the next frames without restarting
+        profile_frames = args.profile if frames_scanned == 0 else 0
+        if key_pressed("o"):
+            profile_frames = timing.PROFILE_FRAMES
+        if profile_frames and profiler.start(profile_frames, game_number, move_count + 1):
+            logger.info(
+                "Profiling %d frames from game #%d, move #%d",
+                profile_frames,
+                game_number,
+                move_count + 1,
+            )
+        if args.max_frames and frames_scanned >= args.max_frames:
+            break
+        with timer.stage("stability"):
+            if source.live:
+                # Wait for animations to finish before scanning; the planner
+                # starts on grids recognized while the board still moves
+                on_frame = None
+                if planner:
+                    on_frame = partial(
+                        plan_provisional,
+                        planner=planner,
+                        tracker=recognition_tracker,
+                        geometry=geometry,
+                        failed_moves=failed_moves,
+                        table=transposition_table,
+                    )
+                settled = wait_for_stable_board(
+                    top_left, bottom_right, logger, settle_model, *pending_event,
+                    on_frame=on_frame,
+                )
+                pending_event = (None, None)
+            else:
+                if not source.advance():
+                    logger.info("Replay finished")
+                    break
+                # Recorded frames were taken after the stability wait
+                settled = np.ones((GRID_SIZE, GRID_SIZE), dtype=bool)
+
+        with timer.stage("capture"):
+            raw_image = capture_raw(top_left, bottom_right, raw_image)
+        frames_scanned += 1
+        if args.record_dir:
+            cv2.imwrite(
+                os.path.join(args.record_dir, f"{frames_scanned:06d}_{source.now():.3f}.png"),
+                raw_image,
+            )
+        geometry = geometry.for_image(raw_image)
+        with timer.stage("recognition"):
+            if INCREMENTAL_RECOGNITION:
+                color_grid, grid_hsv, reclassified = update_color_grid(
+                    raw_image, recognition_tracker, geometry
+                )
+                logger.debug("Re-classified %d/%d cells", reclassified, GRID_SIZE * GRID_SIZE)
+            else:
+                color_grid, grid_hsv = build_color_grid(
+                    raw_image, geometry=geometry, hsv_out=grid_hsv
+                )
+        if session_writer:
+            record = {
+                "timestamp": source.now(),
+                "frame": raw_image,
+                "grid": color_grid,
+                "timings": timer.frame,
+                "game": game_number,
+            }
 
         # Build gem screenshot library (saves one example per color type)
-        save_gem_library(raw_image, color_grid)
+        with timer.stage("gem_library"):
+            save_gem_library(raw_image, color_grid, geometry)
 
         # P: snapshot all 64 cells for manual review (catches special gems)
-        if keyboard.is_pressed("p"):
+        if key_pressed("p"):
             snap_dir = os.path.join(os.path.dirname(__file__) or ".", "gem_library", "snapshot")
             os.makedirs(snap_dir, exist_ok=True)
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            cell_w = raw_image.shape[1] // GRID_SIZE
-            cell_h = raw_image.shape[0] // GRID_SIZE
             for r in range(GRID_SIZE):
                 for c in range(GRID_SIZE):
-                    cell_img = raw_image[r * cell_h : (r + 1) * cell_h, c * cell_w : (c + 1) * cell_w]
+                    cell_img = geometry.cell(raw_image, r, c)
                     color = color_grid[r][c] or "empty"
                     cv2.imwrite(os.path.join(snap_dir, f"{ts}_r{r}_c{c}_{color}.png"), cell_img)
             logger.info("Snapshot: saved 64 cells to gem_library/snapshot/")
             time.sleep(0.5)  # Debounce
 
         # Show overlay for visual feedback
-        display_image = add_grid_overlay(raw_image.copy())
-        cv2.imshow("Grid Overlay", display_image)
-        cv2.waitKey(1)
+        if show_overlay:
+            with timer.stage("overlay"):
+                display_image = capture.copy_into(raw_image, display_image, "overlay")
+                add_grid_overlay(display_image, geometry)
+                cv2.imshow("Grid Overlay", display_image)
+                cv2.waitKey(1)
 
         identified = sum(1 for row in color_grid for c in row if c)
         logger.debug(
@@ -967,10 +1437,10 @@ def main():
         valid, reason = is_valid_board(color_grid)
         if not valid:
             if non_game_since is None:
-                non_game_since = time.time()
+                non_game_since = source.now()
                 logger.info("Non-game screen detected (%s), waiting...", reason)
 
-            elapsed_non_game = time.time() - non_game_since
+            elapsed_non_game = source.now() - non_game_since
 
             # Brief interruptions (level transitions, bonus animations) clear
             # within a few seconds. Only pause if it persists 10+ seconds.
@@ -978,7 +1448,8 @@ def main():
                 logger.debug(
                     "Non-game screen for %.1fs, waiting...", elapsed_non_game
                 )
-                time.sleep(1.0)
+                if source.live:
+                    time.sleep(1.0)
                 continue
 
             # Persistent non-game screen = game over
@@ -990,12 +1461,12 @@ def main():
                 elapsed_non_game,
             )
 
-            # Pause until user presses Space or Escape
-            while True:
-                if keyboard.is_pressed("space"):
+            # Pause until user presses Space or Escape (replays go straight on)
+            while source.live:
+                if key_pressed("space"):
                     time.sleep(0.3)  # Debounce
                     break
-                if keyboard.is_pressed("esc"):
+                if key_pressed("esc"):
                     elapsed = time.time() - start_time
                     logger.info(
                         "Bot stopped. Total moves: %d across %d game(s), Duration: %.1fs",
@@ -1003,7 +1474,23 @@ def main():
                         game_number,
                         elapsed,
                     )
-                    cv2.destroyAllWindows()
+                    if parallel_search:
+                        parallel_search.shutdown()
+                    if planner:
+                        planner.shutdown()
+                    if use_capture_thread:
+                        logger.info("Capture: %s", stop_capture())
+                    logger.info("Frame pipeline: %s", capture.pipeline_stats(frames_scanned))
+                    if record:
+                        session_writer.append(**record)
+                    if session_writer:
+                        session_writer.close()
+                    timer.close()
+                    logger.info("%s", timer.report())
+                    if profiler.active:
+                        logger.info("Profile saved: %s", profiler.stop())
+                    if show_overlay:
+                        cv2.destroyAllWindows()
                     return
                 time.sleep(0.1)
 
@@ -1013,12 +1500,29 @@ def main():
             last_move = None
             move_history.clear()
             failed_moves.clear()
+            if planner:
+                planner.cancel()  # The table is about to be cleared
+                logger.info("Planner: %s", planner.stats())
+            logger.info("Previous game search cache: %s", transposition_table.stats())
+            if INCREMENTAL_RECOGNITION:
+                logger.info("Recognition: %s", recognition_tracker.stats())
+            if settle_model:
+                logger.info("%s", settle_model.report())
+            logger.info("%s", timer.report())
+            transposition_table.clear()
+            if parallel_search:
+                parallel_search.new_game()
             logger.info("Resuming - Game #%d", game_number)
 
             # Re-detect grid in case window moved
-            new_coords = find_grid_from_window(logger)
+            new_coords = find_grid_from_window(logger) if source.live else None
             if new_coords:
                 top_left, bottom_right, hwnd = new_coords
+                geometry = recognition.grid_geometry(tuple(top_left), tuple(bottom_right))
+                recognition_tracker.reset()
+                if use_capture_thread:
+                    logger.info("Capture: %s", stop_capture())
+                    start_capture(top_left, bottom_right)
                 logger.info(
                     "Updated grid: top-left=%s, bottom-right=%s",
                     top_left,
@@ -1032,10 +1536,15 @@ def main():
         # Save unknown gems only on validated boards (avoids animation junk).
         # Only re-identify the unknown cells instead of all 64.
         if identified < GRID_SIZE * GRID_SIZE:
+            if grid_hsv.shape != raw_image.shape:
+                # Subsampled recognition: saved cells need full resolution
+                grid_hsv = cv2.cvtColor(raw_image, cv2.COLOR_BGR2HSV)
             for r in range(GRID_SIZE):
                 for c in range(GRID_SIZE):
                     if not color_grid[r][c]:
-                        identify_cell_color(raw_image, grid_hsv, r, c, save_unknowns=True)
+                        identify_cell_color(
+                            raw_image, grid_hsv, r, c, save_unknowns=True, geometry=geometry
+                        )
 
         # Clear blacklist only on significant board changes (4+ cells = real cascade).
         # Minor flickers (1-2 cells from hint glow) should NOT reset the blacklist.
@@ -1058,23 +1567,64 @@ def main():
                     move_history.clear()
             prev_grid_state = grid_state
 
-        move, score = find_optimal_move(color_grid, failed_moves)
+        # Partly animating board: keep moves off the cells that are still moving
+        unsettled = set() if settled.all() else board.unsettled_moves(settled)
+        motion = None
+        if planner and source.live:
+            # Pipelined: the planner searches this grid during the double-scan
+            # wait. A board that changed as a whole cancels the plan; on a
+            # partly animating board the move must be known first (below).
+            planner.submit(
+                board.encode_grid(color_grid),
+                failed_moves | unsettled,
+                transposition_table,
+                refill_model(color_grid),
+            )
+            with timer.stage("double_scan"):
+                raw_image2, motion = double_scan(top_left, bottom_right, raw_image, raw_image2)
+            if not unsettled and float(motion.mean()) > STABILITY_THRESHOLD:
+                planner.cancel()
+                logger.debug(
+                    "Board changed during planning (diff=%.2f), re-scanning", float(motion.mean())
+                )
+                continue
+        # With the planner this only waits for its plan (the search itself
+        # runs on the planner thread), so it is timed as its own stage
+        with timer.stage("plan_wait" if planner else "search"):
+            move, score = choose_move(
+                color_grid,
+                failed_moves | unsettled,
+                logger,
+                transposition_table,
+                parallel_search,
+                planner,
+            )
+        logger.debug("Search cache: %s", transposition_table.stats())
 
         if move:
             # --- Double-scan validation ---
             # Quick pixel-diff check instead of a full grid rebuild.
             # Uses the same approach as wait_for_stable_board: compare raw
-            # frames. Much faster than re-identifying all 64 cells.
-            time.sleep(STABILITY_DELAY)
-            raw_image2 = capture_raw(top_left, bottom_right)
-            diff = np.mean(np.abs(
-                raw_image2.astype(np.int16) - raw_image.astype(np.int16)
-            ))
-            if diff > STABILITY_THRESHOLD:
-                logger.debug(
-                    "Board changed during planning (diff=%.2f), re-scanning", diff
-                )
-                continue
+            # frames. Much faster than re-identifying all 64 cells. On a
+            # partly animating board only the move's neighborhood must hold.
+            # A replay has one frame per scan, so there is nothing to compare.
+            # The pipelined planner has already taken the second frame.
+            if source.live:
+                if motion is None:
+                    with timer.stage("double_scan"):
+                        raw_image2, motion = double_scan(
+                            top_left, bottom_right, raw_image, raw_image2
+                        )
+                diff = float(motion.mean())
+                if unsettled:
+                    changed = move in board.unsettled_moves(motion < STABILITY_THRESHOLD)
+                else:
+                    changed = diff > STABILITY_THRESHOLD
+                if changed:
+                    logger.debug(
+                        "Board changed during planning (diff=%.2f), re-scanning", diff
+                    )
+                    continue
 
             from_row, from_col, to_row, to_col = move
 
@@ -1103,12 +1653,20 @@ def main():
                     "Move [%d,%d]->[%d,%d] stuck %d times, blacklisting area (%d moves blocked)",
                     *move, repeat_count, len(failed_moves),
                 )
-                move, score = find_optimal_move(color_grid, failed_moves)
+                move, score = choose_move(
+                    color_grid,
+                    failed_moves | unsettled,
+                    logger,
+                    transposition_table,
+                    parallel_search,
+                    planner,
+                )
                 if not move:
                     logger.info("No alternative moves, clearing blacklist")
                     failed_moves.clear()
                     move_history.clear()
-                    time.sleep(0.5)
+                    if source.live:
+                        time.sleep(0.5)
                     continue
 
                 from_row, from_col, to_row, to_col = move
@@ -1133,11 +1691,30 @@ def main():
                 score,
             )
 
-            perform_move(top_left, bottom_right, from_row, from_col, to_row, to_col, hwnd)
+            if source.live:
+                with timer.stage("move"):
+                    perform_move(
+                        top_left, bottom_right, from_row, from_col, to_row, to_col, hwnd,
+                        geometry, settle_model,
+                    )
+            if record:
+                record.update(move=move, score=score)
+            if settle_model:
+                levels = board.cascade_depth(board.encode_grid(color_grid), move)
+                pending_event = (polling.event_type(levels), time.time())
             last_move = move
         else:
             logger.debug("No valid move found this frame")
 
+    if record:
+        session_writer.append(**record)
+    if session_writer:
+        session_writer.close()
+        logger.info("Session: %d records written to %s", session_writer.count, args.session)
+    timer.close()
+    if profiler.active:
+        logger.info("Profile saved: %s", profiler.stop())
+
     elapsed = time.time() - start_time
     logger.info(
         "Bot stopped. Total moves: %d across %d game(s), Duration: %.1fs",
@@ -1145,7 +1722,26 @@ def main():
         game_number,
         elapsed,
     )
-    cv2.destroyAllWindows()
+    logger.info(
+        "Scanned %d frames (%.1f frames/s)", frames_scanned, frames_scanned / max(elapsed, 1e-9)
+    )
+    if planner:
+        planner.shutdown()
+        logger.info("Planner: %s", planner.stats())
+    logger.info("Search cache: %s", transposition_table.stats())
+    logger.info("%s", timer.report())
+    if INCREMENTAL_RECOGNITION:
+        logger.info("Recognition: %s", recognition_tracker.stats())
+    if settle_model:
+        logger.info("%s", settle_model.report())
+    if parallel_search:
+        parallel_search.shutdown()
+    if use_capture_thread:
+        logger.info("Capture: %s", stop_capture())
+    logger.info("Frame pipeline: %s", capture.pipeline_stats(frames_scanned))
+    source.close()
+    if show_overlay:
+        cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
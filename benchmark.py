@@ -0,0 +1,423 @@
+"""
+Offline benchmark for BejeweledBot's recognition and move search.
+
+Runs headless on a fixed corpus: seeded synthetic boards (rendered to images
+for recognition), plus optionally captured frames from a frame directory,
+session file or packed .npz (anything --replay accepts). Each stage is timed
+per board and reported as p50/p99 latency and throughput:
+
+    recognition  build_color_grid on a frame (RECOGNITION_MODE)
+    swap_filter  board.legal_swap_mask on one board
+    step1        board.score_swaps of every legal swap of a board
+    lookahead    search.search_move to SEARCH_MAX_DEPTH, no time budget
+                 (also reports mean search nodes)
+
+Results are written as JSON so runs can be compared over time:
+
+    python benchmark.py --out before.json
+    python benchmark.py --corpus recordings/run1.bjs --out after.json --compare before.json
+
+--self-check instead runs the rules engine on a corpus of hand-checked boards
+(SELF_CHECK_CASES) and exits non-zero on any mismatch.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import bejeweled
+import board
+import capture
+import recognition
+import search
+from board import GRID_SIZE
+
+BENCH_BOARDS = 100  # Synthetic boards in the corpus
+BENCH_SEED = 2024  # Corpus seed; change it and results are no longer comparable
+BENCH_CELL = 75  # Cell size (px) of rendered synthetic boards (1920x1200 grid is ~75)
+BENCH_SPECIAL_RATE = 0.04  # Fraction of synthetic gems made flame or star gems
+BENCH_HYPERCUBE_RATE = 0.01  # Fraction of synthetic gems made hypercubes
+BENCH_WARMUP = 3  # Untimed calls per stage before measuring (fills lru caches)
+
+# Rendered gem colors (HSV): well inside recognition's hue ranges
+_RENDER_HSV = {
+    "red": (0, 220, 220),
+    "orange": (14, 220, 230),
+    "yellow": (27, 220, 230),
+    "green": (60, 220, 200),
+    "blue": (105, 220, 220),
+    "purple": (150, 200, 200),
+    "white": (0, 20, 240),
+    "hypercube": (90, 60, 180),
+}
+
+
+# Hand-checked rules corpus. Each board is the FILLER pattern with the listed
+# gems placed on top (None = empty cell). The filler never has two equal
+# neighbours, and gravity after one cleared stretch per column makes at most
+# pairs, so any match comes from the placed gems. cleared: gems removed by the
+# move's first level (created gems excluded), plus every cell whose gem has a color in
+# "wiped" after the swap; created: special gems left behind; score: total
+# score_swaps value including cascades. Hypercube cases give wipe_score, the
+# score_hypercube_swaps value (hoarding policy not applied).
+FILLER = ("green", "blue", "purple", "white")
+SELF_CHECK_CASES = [
+    {
+        "name": "run of 4 leaves a Flame Gem on the swapped cell",
+        "gems": {(7, 0): "red", (7, 1): "red", (7, 3): "red", (6, 2): "red"},
+        "move": (6, 2, 7, 2),
+        "cleared": [(7, 0), (7, 1), (7, 3)],
+        "created": {(7, 2): "red_flame"},
+        "score": 100,
+    },
+    {
+        "name": "run of 5 leaves a Hypercube",
+        "gems": {(7, 0): "red", (7, 1): "red", (7, 3): "red", (7, 4): "red", (6, 2): "red"},
+        "move": (6, 2, 7, 2),
+        "cleared": [(7, 0), (7, 1), (7, 3), (7, 4)],
+        "created": {(7, 2): "hypercube"},
+        "score": 500,
+    },
+    {
+        "name": "L shape leaves a Star Gem on the corner",
+        "gems": {(5, 2): "red", (6, 2): "red", (7, 0): "red", (7, 1): "red", (7, 3): "red"},
+        "move": (7, 2, 7, 3),
+        "cleared": [(5, 2), (6, 2), (7, 0), (7, 1)],
+        "created": {(7, 2): "red_star"},
+        "score": 250,
+    },
+    {
+        "name": "matched Flame Gem clears its 3x3 neighbourhood",
+        "gems": {(7, 3): "red_flame", (7, 4): "red", (6, 5): "red"},
+        "move": (6, 5, 7, 5),
+        "cleared": [(7, 3), (7, 4), (7, 5), (6, 2), (6, 3), (6, 4), (7, 2)],
+        "created": {},
+        "score": 50 + 4 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "matched Star Gem clears its row and column",
+        "gems": {(4, 4): "red_star", (4, 5): "red", (3, 6): "red"},
+        "move": (3, 6, 4, 6),
+        "cleared": [(4, c) for c in range(GRID_SIZE)] + [(r, 4) for r in range(GRID_SIZE)],
+        "created": {},
+        "score": 50 + 12 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "Star blast through empty cells scores only the gems it destroys",
+        "gems": {
+            **{(r, c): None for r in range(3) for c in range(GRID_SIZE)},
+            (4, 4): "red_star", (4, 5): "red", (3, 6): "red",
+        },
+        "move": (3, 6, 4, 6),
+        "cleared": [(4, c) for c in range(GRID_SIZE)] + [(r, 4) for r in range(3, GRID_SIZE)],
+        "created": {},
+        "score": 50 + 9 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "Flame blast sets off a Star Gem",
+        "gems": {(7, 3): "red_flame", (7, 4): "red", (6, 5): "red", (6, 2): "yellow_star"},
+        "move": (6, 5, 7, 5),
+        "cleared": [(6, c) for c in range(GRID_SIZE)] + [(r, 2) for r in range(GRID_SIZE)]
+        + [(7, 3), (7, 4), (7, 5)],
+        "created": {},
+        "score": 50 + 15 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "Flame blast sets off a Hypercube: most common remaining color is wiped",
+        "gems": {(7, 3): "red_flame", (7, 4): "red", (6, 5): "red", (6, 2): "hypercube"},
+        "move": (6, 5, 7, 5),
+        "cleared": [(7, 3), (7, 4), (7, 5), (6, 2), (6, 3), (6, 4), (7, 2)],
+        "wiped": ["white"],
+        "created": {},
+    },
+    {
+        "name": "Hypercube swapped with red wipes every red gem",
+        "gems": {(7, 0): "hypercube", (7, 1): "red", (0, 5): "red", (3, 3): "red"},
+        "move": (7, 0, 7, 1),
+        "wipe_score": 4 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "Hypercube wipe sets off a red Flame Gem",
+        "gems": {(7, 0): "hypercube", (7, 1): "red", (0, 5): "red", (3, 3): "red_flame"},
+        "move": (7, 0, 7, 1),
+        "wipe_score": 12 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "Hypercube wipe sets off a Flame Gem next to empty cells",
+        "gems": {
+            (7, 0): "hypercube", (7, 1): "red", (0, 5): "red", (3, 3): "red_flame",
+            (2, 2): None, (2, 3): None, (2, 4): None,
+        },
+        "move": (7, 0, 7, 1),
+        "wipe_score": 9 * board.DETONATED_GEM_SCORE,
+    },
+    {
+        "name": "two Hypercubes swapped clear the whole board",
+        "gems": {(7, 0): "hypercube", (7, 1): "hypercube"},
+        "move": (7, 0, 7, 1),
+        "wipe_score": GRID_SIZE * GRID_SIZE * board.DETONATED_GEM_SCORE,
+    },
+]
+
+
+def self_check_board(gems):
+    """FILLER board with the given {(row, col): gem name or None} placed on top."""
+    codes = np.array(
+        [
+            [board.NAME_TO_CODE[FILLER[(col + 2 * row) % len(FILLER)]] for col in range(GRID_SIZE)]
+            for row in range(GRID_SIZE)
+        ],
+        dtype=np.uint8,
+    )
+    for (row, col), name in gems.items():
+        codes[row, col] = board.EMPTY if name is None else board.NAME_TO_CODE[name]
+    return codes
+
+
+def self_check(cases=SELF_CHECK_CASES):
+    """Run the rules engine on the hand-checked corpus. Returns the failure messages."""
+    failures = []
+    for case in cases:
+        codes = self_check_board(case["gems"])
+        idx = board.SWAP_INDEX[case["move"]]
+        if "wipe_score" in case:
+            score = int(board.score_hypercube_swaps(codes[None], np.array([idx]))[0][0])
+            if score != case["wipe_score"]:
+                failures.append(f"{case['name']}: score {score}, expected {case['wipe_score']}")
+            continue
+        swapped = board.apply_swaps(codes[None], np.array([idx]))
+        r1, c1, r2, c2 = case["move"]
+        cleared, created, _ = board.resolve_matches(swapped, np.array([[r1], [c1], [r2], [c2]]))
+
+        expected = np.zeros((GRID_SIZE, GRID_SIZE), dtype=bool)
+        expected[tuple(np.array(case["cleared"]).T)] = True
+        for color in case.get("wiped", ()):
+            expected |= (swapped[0] & board.BASE_MASK) == board.NAME_TO_CODE[color]
+        expected_created = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.uint8)
+        for (row, col), name in case["created"].items():
+            expected_created[row, col] = board.NAME_TO_CODE[name]
+            expected[row, col] = False
+
+        got = cleared[0] & (created[0] == board.EMPTY) & (swapped[0] != board.EMPTY)
+        if not np.array_equal(got, expected):
+            failures.append(
+                f"{case['name']}: cleared {sorted(zip(*np.nonzero(got)))} "
+                f"expected {sorted(zip(*np.nonzero(expected)))}"
+            )
+        if not np.array_equal(created[0], expected_created):
+            failures.append(f"{case['name']}: created {board.decode_grid(created[0])}")
+        if "score" in case:
+            score = int(board.score_swaps(codes[None], np.array([idx]))[0][0])
+            if score != case["score"]:
+                failures.append(f"{case['name']}: score {score}, expected {case['score']}")
+    return failures
+
+
+def synthetic_boards(count=BENCH_BOARDS, seed=BENCH_SEED):
+    """Seeded settled boards (no match standing) with a sprinkling of special gems.
+
+    Returns a (count, 8, 8) uint8 stack of board codes.
+    """
+    rng = np.random.default_rng(seed)
+    colors = len(board.BASE_COLORS)
+    boards = rng.integers(1, colors + 1, size=(count, GRID_SIZE, GRID_SIZE)).astype(np.uint8)
+    while True:
+        h_mask, v_mask, _ = board.find_match_mask(boards)
+        matched = h_mask | v_mask
+        if not matched.any():
+            break
+        boards[matched] = rng.integers(1, colors + 1, size=int(matched.sum()))
+    roll = rng.random(boards.shape)
+    boards[roll < BENCH_SPECIAL_RATE] |= board.FLAME_FLAG
+    boards[roll < BENCH_SPECIAL_RATE / 2] ^= board.FLAME_FLAG | board.STAR_FLAG
+    boards[roll > 1 - BENCH_HYPERCUBE_RATE] = board.HYPERCUBE
+    return boards
+
+
+def render_board(codes, cell=BENCH_CELL):
+    """Draw a board as a BGR grid image: one filled disc per gem on a dark cell."""
+    hsv = np.zeros((GRID_SIZE * cell, GRID_SIZE * cell, 3), dtype=np.uint8)
+    hsv[..., 2] = 30
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            name = bejeweled.gem_base_color(board.CODE_TO_NAME.get(int(codes[row, col]), ""))
+            if name in _RENDER_HSV:
+                center = (col * cell + cell // 2, row * cell + cell // 2)
+                cv2.circle(hsv, center, cell // 3, _RENDER_HSV[name], -1)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def captured_corpus(path):
+    """Frames of a recording (anything capture.open_source takes) and their classified boards."""
+    source = capture.open_source(path)
+    frames = []
+    while source.advance():
+        frames.append(source.grab(None).copy())
+    source.close()
+    boards = [board.encode_grid(bejeweled.build_color_grid(frame)[0]) for frame in frames]
+    return frames, boards
+
+
+def time_stage(func, items, repeat=1):
+    """Time func(item) for every item, repeat times. Returns per-call seconds."""
+    for item in items[:BENCH_WARMUP]:
+        func(item)
+    times = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            func(item)
+            times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def summarize(times):
+    """p50/p99/mean latency (ms) and throughput (calls/s) of a stage."""
+    return {
+        "n": len(times),
+        "p50_ms": round(float(np.percentile(times, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(times, 99)) * 1000, 4),
+        "mean_ms": round(float(times.mean()) * 1000, 4),
+        "throughput_per_s": round(len(times) / float(times.sum()), 2),
+    }
+
+
+def _step1(codes):
+    swap_idx = np.flatnonzero(board.legal_swap_mask(codes))
+    if swap_idx.size:
+        board.score_swaps(np.repeat(codes[None], len(swap_idx), axis=0), swap_idx)
+
+
+def _lookahead(codes):
+    result = search.search_move(codes, time_budget_ms=None)
+    _search_nodes.append(result.nodes)
+
+
+_search_nodes = []  # Nodes of every _lookahead call
+
+
+def run(corpus_paths=(), count=BENCH_BOARDS, repeat=1, stages=None):
+    """Benchmark every stage on the corpus. Returns the results dict written as JSON."""
+    boards = list(synthetic_boards(count))
+    frames = [render_board(codes) for codes in boards]
+    for path in corpus_paths:
+        captured_frames, captured_boards = captured_corpus(path)
+        frames += captured_frames
+        boards += captured_boards
+
+    benches = {
+        "recognition": (lambda frame: bejeweled.build_color_grid(frame), frames),
+        "swap_filter": (board.legal_swap_mask, boards),
+        "step1": (_step1, boards),
+        "lookahead": (_lookahead, boards),
+    }
+    results = {}
+    for name, (func, items) in benches.items():
+        if stages and name not in stages:
+            continue
+        del _search_nodes[:]
+        results[name] = summarize(time_stage(func, items, repeat))
+        if name == "lookahead":
+            nodes = np.array(_search_nodes[-results[name]["n"]:])
+            results[name]["nodes_mean"] = round(float(nodes.mean()), 1)
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "corpus": {
+                "synthetic_boards": count,
+                "seed": BENCH_SEED,
+                "captured": list(corpus_paths),
+                "frames": len(frames),
+                "boards": len(boards),
+            },
+            "settings": {
+                "recognition_mode": bejeweled.RECOGNITION_MODE,
+                "subsample_side": recognition.SUBSAMPLE_SIDE,
+                "search_max_depth": search.SEARCH_MAX_DEPTH,
+                "search_beam_width": search.SEARCH_BEAM_WIDTH,
+            },
+            "repeat": repeat,
+        },
+        "stages": results,
+    }
+
+
+def format_results(results, baseline=None):
+    """Results as a text table; with a baseline, p50 and throughput changes are shown."""
+    lines = [f"{'stage':<12} {'n':>6} {'p50 ms':>10} {'p99 ms':>10} {'per s':>10}"]
+    for name, stats in results["stages"].items():
+        line = (
+            f"{name:<12} {stats['n']:>6} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f} "
+            f"{stats['throughput_per_s']:>10.1f}"
+        )
+        old = (baseline or {}).get("stages", {}).get(name)
+        if old:
+            throughput = stats["throughput_per_s"] / old["throughput_per_s"] - 1
+            line += (
+                f"   p50 {(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+.1f}%, "
+                f"throughput {throughput * 100:+.1f}%"
+            )
+        lines.append(line)
+        if "nodes_mean" in stats:
+            line = f"{'':<12} nodes/search {stats['nodes_mean']:.1f}"
+            if old and "nodes_mean" in old:
+                line += f"   nodes {(stats['nodes_mean'] / old['nodes_mean'] - 1) * 100:+.1f}%"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recognition and move search")
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="captured frames to add (frame directory, session or .npz file; repeatable)",
+    )
+    parser.add_argument("--boards", type=int, default=BENCH_BOARDS, help="synthetic boards")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the corpus")
+    parser.add_argument(
+        "--stage", action="append", choices=["recognition", "swap_filter", "step1", "lookahead"],
+        help="only run these stages (repeatable)",
+    )
+    parser.add_argument(
+        "--self-check", action="store_true", help="check the rules engine on hand-checked boards"
+    )
+    parser.add_argument("--out", metavar="JSON", help="write results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="show changes against earlier results")
+    args = parser.parse_args(argv)
+
+    if args.self_check:
+        failures = self_check()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print(f"{len(SELF_CHECK_CASES) - len({f.split(':')[0] for f in failures})}"
+              f"/{len(SELF_CHECK_CASES)} rules cases passed")
+        sys.exit(1 if failures else 0)
+
+    results = run(args.corpus, args.boards, args.repeat, args.stage)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,817 @@
+"""
+Compact integer board engine for BejeweledBot.
+
+Stores the 8x8 grid as a uint8 NumPy array instead of nested lists of color
+names. Each cell code packs the base color into the low nibble and the special
+gem type into flag bits, so match detection, clearing and gravity run as a
+handful of whole-board array operations instead of per-cell Python loops.
+Legal moves come from per-board run tables (run_tables): how far each
+cell's color run reaches in every direction answers "does this swap match,
+and how long is the line" with a few lookups per swap.
+
+With SPECIAL_RULES the cascades follow Bejeweled 3: matches of 4+ and L/T
+shapes leave special gems behind, and cleared Flame Gems, Star Gems and
+Hypercubes detonate (resolve_matches). With it off, scores are identical to
+the list-based simulator in bejeweled.py, so the two engines can be run side
+by side and compared.
+"""
+
+import numpy as np
+
+GRID_SIZE = 8
+
+# Heuristic scoring weights (loosely based on Bejeweled 3 point values)
+MATCH_WEIGHTS = {3: 50, 4: 100, 5: 500}  # 4=Flame Gem, 5=Hypercube
+STAR_GEM_BONUS = 150  # L/T match creating a Star Gem
+CASCADE_BASE_BONUS = 50  # Increases by 50 per cascade level
+BOTTOM_ROW_BONUS = 2  # Small tiebreaker per row toward bottom
+
+# Bonus scores for moves involving special gems
+HYPERCUBE_SWAP_SCORE = 1  # Last resort: save hypercubes until no other moves exist
+# Hypercube swaps: simulate the color wipe and its cascades (score_hypercube_swaps),
+# then hoard the cube (score HYPERCUBE_SWAP_SCORE) unless the wipe is worth it
+HYPERCUBE_SIMULATE = True  # False = every hypercube swap scores HYPERCUBE_SWAP_SCORE
+# Wipes scoring less than this keep the cube for later (0 = never hoard)
+HYPERCUBE_HOARD_BELOW = 600
+FLAME_MATCH_BONUS = 200  # 3x3 explosion (~8 extra gems)
+STAR_MATCH_BONUS = 400  # Cross detonation (~14 extra gems)
+
+# Bejeweled 3 special gem rules (resolve_matches): matches leave Flame Gems,
+# Star Gems and Hypercubes on the board, and cleared specials detonate
+SPECIAL_RULES = True  # False = flat FLAME/STAR_MATCH_BONUS for a swapped special
+DETONATED_GEM_SCORE = 25  # Per gem destroyed by a detonation rather than a match
+
+# Cell encoding: low nibble = base color, high bits = special type flags.
+# 0 is an empty (or unidentified) cell, 1-7 are matchable colors.
+EMPTY = 0
+BASE_COLORS = ("red", "orange", "yellow", "green", "blue", "purple", "white")
+HYPERCUBE = 8
+BASE_MASK = 0x0F
+FLAME_FLAG = 0x10
+STAR_FLAG = 0x20
+SPECIAL_MASK = FLAME_FLAG | STAR_FLAG
+
+# Transposition table entry kinds (see transposition.py)
+TT_CASCADE = "cascade"  # (score, resulting_board) of a cascade simulation
+TT_NEXT = "next"  # best follow-up score on a settled board
+TT_WIPE = "wipe"  # (score, resulting_board) of the cascade after a hypercube wipe
+
+
+def _build_code_tables():
+    """Build the gem name <-> cell code lookup tables."""
+    name_to_code = {"": EMPTY, "hypercube": HYPERCUBE}
+    for idx, color in enumerate(BASE_COLORS, start=1):
+        name_to_code[color] = idx
+        name_to_code[f"{color}_flame"] = idx | FLAME_FLAG
+        name_to_code[f"{color}_star"] = idx | STAR_FLAG
+    code_to_name = {code: name for name, code in name_to_code.items()}
+    return name_to_code, code_to_name
+
+
+NAME_TO_CODE, CODE_TO_NAME = _build_code_tables()
+
+
+def encode_grid(color_grid):
+    """Convert a list-of-lists color grid into a (8, 8) uint8 code array.
+
+    Unrecognized names are stored as EMPTY, matching how the list engine
+    treats cells whose base color never forms a run.
+    """
+    return np.array(
+        [[NAME_TO_CODE.get(c, EMPTY) for c in row] for row in color_grid],
+        dtype=np.uint8,
+    )
+
+
+def decode_grid(board):
+    """Convert a (8, 8) code array back into a list-of-lists color grid."""
+    return [[CODE_TO_NAME.get(int(c), "") for c in row] for row in board]
+
+
+def _build_line_tables():
+    """Precompute per-line match results for every neighbour-equality pattern.
+
+    A line of GRID_SIZE cells is summarized by GRID_SIZE-1 bits, bit c set when
+    cells c and c+1 share a matchable color. For each of those patterns the
+    tables hold the bitmask of cells in runs of 3+ and the summed
+    MATCH_WEIGHTS of those runs, so matching a line is a single lookup.
+    """
+    n_patterns = 1 << (GRID_SIZE - 1)
+    cover = np.zeros(n_patterns, dtype=np.uint8)
+    score = np.zeros(n_patterns, dtype=np.int32)
+    for pattern in range(n_patterns):
+        col = 0
+        while col < GRID_SIZE:
+            run = 1
+            while col + run < GRID_SIZE and pattern >> (col + run - 1) & 1:
+                run += 1
+            if run >= 3:
+                cover[pattern] |= ((1 << run) - 1) << col
+                score[pattern] += MATCH_WEIGHTS[min(run, 5)]
+            col += run
+    return cover, score
+
+
+_LINE_COVER, _LINE_SCORE = _build_line_tables()
+_CELL_BITS = (1 << np.arange(GRID_SIZE)).astype(np.uint8)
+
+# Random 64-bit key per cell, XORed into a post-swap board's transposition
+# key: with SPECIAL_RULES its cascade depends on where the swap happened
+_SWAP_CELL_KEYS = np.random.default_rng(0x5A1F).integers(
+    0, np.iinfo(np.uint64).max, size=GRID_SIZE * GRID_SIZE, dtype=np.uint64,
+)
+
+
+def _build_run_tables():
+    """Precompute, per line pattern and cell, the bitmask of the 3+ run holding the cell.
+
+    0 marks a cell outside any run. Also returns the popcount (run length)
+    and highest set bit (the run's last cell) of every 8-bit mask.
+    """
+    run_of = np.zeros((1 << (GRID_SIZE - 1), GRID_SIZE), dtype=np.uint8)
+    for pattern in range(len(run_of)):
+        col = 0
+        while col < GRID_SIZE:
+            run = 1
+            while col + run < GRID_SIZE and pattern >> (col + run - 1) & 1:
+                run += 1
+            if run >= 3:
+                run_of[pattern, col : col + run] = ((1 << run) - 1) << col
+            col += run
+    popcount = np.array([bin(mask).count("1") for mask in range(256)], dtype=np.uint8)
+    high_bit = np.array([mask.bit_length() - 1 for mask in range(256)], dtype=np.int8)
+    return run_of, popcount, high_bit
+
+
+_RUN_OF, _POPCOUNT, _HIGH_BIT = _build_run_tables()
+_LINE_POS = np.arange(GRID_SIZE)
+
+
+def _build_gravity_table():
+    """Precompute the gather order that drops gems in a column.
+
+    Indexed by the column's occupancy bitmask (bit r set when row r holds a
+    gem). Each entry lists, top to bottom, the source row for every
+    destination row: empty rows first, then occupied rows in their original
+    order, which is exactly what gravity produces.
+    """
+    table = np.zeros((1 << GRID_SIZE, GRID_SIZE), dtype=np.intp)
+    for occupancy in range(1 << GRID_SIZE):
+        rows = range(GRID_SIZE)
+        empty = [r for r in rows if not occupancy >> r & 1]
+        filled = [r for r in rows if occupancy >> r & 1]
+        table[occupancy] = empty + filled
+    return table
+
+
+_GRAVITY_ORDER = _build_gravity_table()
+
+
+def _line_patterns(base):
+    """Neighbour-equality bits of every row and column. Returns (2, ..., 8): rows, then columns."""
+    lines = np.stack((base, np.swapaxes(base, -1, -2)))
+    matchable = (lines != EMPTY) & (lines != HYPERCUBE)
+    eq = matchable[..., :-1] & (lines[..., :-1] == lines[..., 1:])
+    return np.packbits(eq, axis=-1, bitorder="little")[..., 0]
+
+
+def find_match_mask(board):
+    """Find every matched cell on a board. Returns (h_mask, v_mask, run_score).
+
+    Works on a single (8, 8) board or a (N, 8, 8) stack. h_mask/v_mask mark
+    cells in horizontal/vertical runs; run_score sums MATCH_WEIGHTS per run
+    (an int for one board, an (N,) array for a stack). Rows and columns are
+    matched together: each line is reduced to its neighbour-equality bits and
+    looked up in the precomputed line tables.
+    """
+    pattern = _line_patterns(board & BASE_MASK)
+    run_score = _LINE_SCORE[pattern].sum(axis=(0, -1))
+    covered = (_LINE_COVER[pattern][..., None] & _CELL_BITS) != 0
+    return covered[0], np.swapaxes(covered[1], -1, -2), run_score
+
+
+def apply_gravity(board):
+    """Drop gems down to fill empty cells. Returns a new board.
+
+    Each column's occupancy bitmask selects a precomputed gather order that
+    moves empty cells to the top while keeping the remaining gems in order.
+    """
+    occupancy = np.packbits(board != EMPTY, axis=-2, bitorder="little")[..., 0, :]
+    order = _GRAVITY_ORDER[occupancy]
+    return np.take_along_axis(board, np.swapaxes(order, -1, -2), axis=-2)
+
+
+def _line_view(mask):
+    """Stack a (N, 8, 8) mask with its transpose: the (2, N, 8, 8) line layout of _line_patterns."""
+    return np.stack((mask, np.swapaxes(mask, -1, -2)))
+
+
+def _board_view(lines):
+    """Inverse of _line_view: (h, v) board-layout masks from a (2, N, 8, 8) line stack."""
+    return lines[0], np.swapaxes(lines[1], -1, -2)
+
+
+def _blast(boards, base, fire, cleared):
+    """Cells destroyed by the special gems in fire going off."""
+    flames = fire & ((boards & FLAME_FLAG) != 0)
+    near = flames.copy()
+    near[:, 1:] |= flames[:, :-1]
+    near[:, :-1] |= flames[:, 1:]
+    blast = near.copy()
+    blast[:, :, 1:] |= near[:, :, :-1]
+    blast[:, :, :-1] |= near[:, :, 1:]
+
+    stars = fire & ((boards & STAR_FLAG) != 0)
+    blast |= stars.any(axis=2)[:, :, None] | stars.any(axis=1)[:, None, :]
+
+    cubes = (fire & (base == HYPERCUBE)).any(axis=(1, 2))
+    if cubes.any():
+        # A detonated Hypercube wipes the most common color still standing
+        colors = np.arange(1, len(BASE_COLORS) + 1, dtype=np.uint8)
+        standing = (base[cubes, ..., None] == colors) & ~cleared[cubes, ..., None]
+        wipe = colors[np.argmax(standing.sum(axis=(1, 2)), axis=1)]
+        blast[cubes] |= base[cubes] == wipe[:, None, None]
+    return blast
+
+
+def resolve_matches(boards, swap_cells=None):
+    """Apply one level of Bejeweled 3 match rules to a (N, 8, 8) stack.
+
+    Returns (cleared, created, detonated): cells emptied by the matches and
+    the detonations they set off, the special gems the matches leave behind
+    (board codes, EMPTY elsewhere), and per board the number of gems
+    destroyed by detonations rather than matches (blasts also sweep empty
+    cells, which don't count).
+
+    Creation: a run of 4 leaves a Flame Gem, a run of 5+ a Hypercube, and a
+    cell shared by a horizontal and a vertical run (L/T shape) a Star Gem, or
+    a Hypercube when one of those runs is 5+. The new gem takes the run's
+    color and sits on the swapped cell if the run goes through it
+    (swap_cells: (4, N) array of r1, c1, r2, c2), else on the run's last
+    cell (rightmost or bottom). Detonation: every special gem cleared, by a
+    match or a blast, goes off. A Flame clears its 3x3 neighbourhood, a Star
+    its row and column, a Hypercube every gem of the most common remaining
+    color (lowest code on ties). Blasts chain; newly created gems survive.
+    """
+    n = np.arange(len(boards))
+    base = boards & BASE_MASK
+    run_bits = _RUN_OF[_line_patterns(base)[..., None], _LINE_POS]
+    run_len = _POPCOUNT[run_bits]
+    len_h, len_v = _board_view(run_len)
+    cross = (len_h > 0) & (len_v > 0)
+
+    # Runs through an L/T crossing leave their special there, not at an anchor
+    cross_bits = np.packbits(_line_view(cross), axis=-1, bitorder="little")[..., 0]
+    through_cross = (run_bits & cross_bits[..., None]) != 0
+    anchor = (_HIGH_BIT[run_bits] == _LINE_POS) & (run_len >= 4) & ~through_cross
+    if swap_cells is not None:
+        r1, c1, r2, c2 = swap_cells
+        for direction, cells in ((0, ((r1, c1), (r2, c2))), (1, ((c1, r1), (c2, r2)))):
+            for line, pos in cells:
+                bits = run_bits[direction, n, line, pos]
+                moved = (_POPCOUNT[bits] >= 4) & ~through_cross[direction, n, line, pos]
+                in_run = ((bits[:, None] >> _LINE_POS) & 1).astype(bool) & moved[:, None]
+                anchor[direction, n, line] = np.where(
+                    in_run, _LINE_POS == pos[:, None], anchor[direction, n, line]
+                )
+    anchor_h, anchor_v = _board_view(anchor)
+    cube = (
+        (anchor_h & (len_h >= 5))
+        | (anchor_v & (len_v >= 5))
+        | (cross & (np.maximum(len_h, len_v) >= 5))
+    )
+    star = cross & ~cube
+    flame = ((anchor_h & (len_h == 4)) | (anchor_v & (len_v == 4))) & ~cube & ~star
+    created = np.where(
+        cube, np.uint8(HYPERCUBE),
+        np.where(star, base | STAR_FLAG, np.where(flame, base | FLAME_FLAG, EMPTY)),
+    ).astype(np.uint8)
+
+    matched = (len_h > 0) | (len_v > 0)
+    cleared = _detonate(boards, base, matched, np.zeros_like(matched))
+    detonated = np.count_nonzero(cleared & ~matched & (boards != EMPTY), axis=(1, 2))
+    return cleared, created, detonated
+
+
+def _detonate(boards, base, cleared, fired):
+    """Chain detonations: every special gem in cleared and not yet fired goes off.
+
+    Returns cleared grown by all the blasts.
+    """
+    cleared = cleared.copy()
+    fired = fired.copy()
+    special = ((boards & SPECIAL_MASK) != 0) | (base == HYPERCUBE)
+    while True:
+        fire = cleared & special & ~fired
+        if not fire.any():
+            return cleared
+        fired |= fire
+        cleared |= _blast(boards, base, fire, cleared)
+
+
+def evaluate_batch(boards, initial_mask=None, cascade_level=0, swap_cells=None):
+    """Run cascade simulation on a (N, 8, 8) stack. Returns (scores, resulting_boards).
+
+    Every board advances one cascade level per iteration; boards with no
+    matches left drop out of the active set, so the loop runs once per level
+    of the deepest cascade rather than once per board. The input stack is
+    never modified. initial_mask: optional find_match_mask result for the
+    stack, reused for the first cascade level. cascade_level: level of the
+    first match found (non-zero when continuing an earlier cascade).
+    With SPECIAL_RULES each level runs through resolve_matches: specials are
+    created and detonated, and blasted gems score DETONATED_GEM_SCORE each.
+    swap_cells: optional (4, N) swapped cells, where first-level specials form.
+    """
+    boards = boards.copy()
+    scores = np.zeros(len(boards), dtype=np.int64)
+    active = np.arange(len(boards))
+
+    while active.size:
+        if initial_mask is not None:
+            h_mask, v_mask, run_score = initial_mask
+            initial_mask = None
+        else:
+            h_mask, v_mask, run_score = find_match_mask(boards[active])
+        matched = h_mask | v_mask
+        has_match = matched.any(axis=(-2, -1))
+        if not has_match.all():
+            active = active[has_match]
+            h_mask, v_mask = h_mask[has_match], v_mask[has_match]
+            matched, run_score = matched[has_match], run_score[has_match]
+            if swap_cells is not None:
+                swap_cells = swap_cells[:, has_match]
+
+        star_count = np.count_nonzero(h_mask & v_mask, axis=(-2, -1))
+        scores[active] += (
+            run_score
+            + star_count * STAR_GEM_BONUS
+            + cascade_level * CASCADE_BASE_BONUS
+        )
+
+        if SPECIAL_RULES:
+            cleared, created, detonated = resolve_matches(boards[active], swap_cells)
+            scores[active] += detonated * DETONATED_GEM_SCORE
+            remaining = np.where(cleared, np.uint8(EMPTY), boards[active])
+            boards[active] = apply_gravity(np.where(created != EMPTY, created, remaining))
+        else:
+            boards[active] = apply_gravity(np.where(matched, np.uint8(EMPTY), boards[active]))
+        swap_cells = None
+        cascade_level += 1
+
+    return scores, boards
+
+
+def _cached_cascades(boards, table, initial_mask=None, swap_cells=None, kind=TT_CASCADE,
+                     cascade_level=0):
+    """evaluate_batch through a transposition table. Only misses are simulated.
+
+    With SPECIAL_RULES, results for swap_cells are keyed on the swapped cells
+    too, since new specials form on them: two swaps can leave the same board
+    but cascade differently.
+    """
+    salt = None
+    if swap_cells is not None and SPECIAL_RULES:
+        r1, c1, r2, c2 = swap_cells
+        salt = _SWAP_CELL_KEYS[r1 * GRID_SIZE + c1] ^ _SWAP_CELL_KEYS[r2 * GRID_SIZE + c2]
+    keys, values, miss_idx = table.lookup_batch(kind, boards, salt)
+    if miss_idx.size:
+        if initial_mask is not None:
+            initial_mask = tuple(part[miss_idx] for part in initial_mask)
+        if swap_cells is not None:
+            swap_cells = swap_cells[:, miss_idx]
+        scores, resulting = evaluate_batch(
+            boards[miss_idx], initial_mask, cascade_level, swap_cells
+        )
+        computed = [(int(sc), res) for sc, res in zip(scores, resulting)]
+        table.store_batch(kind, keys, values, miss_idx, computed)
+    scores = np.array([score for score, _ in values], dtype=np.int64)
+    return scores, np.stack([res for _, res in values])
+
+
+def evaluate_state(board, initial_mask=None, table=None):
+    """Score the board using cascade simulation. Returns (score, resulting_board).
+
+    Same heuristic as bejeweled.evaluate_state: MATCH_WEIGHTS per run,
+    STAR_GEM_BONUS per cell shared by a horizontal and vertical run, and a
+    cascade bonus growing by CASCADE_BASE_BONUS per level. The input board
+    is never modified. initial_mask: optional (h_mask, v_mask, run_score)
+    from a previous find_match_mask call, reused for the first iteration.
+    table: optional TranspositionTable memoizing the result.
+    """
+    if initial_mask is not None:
+        initial_mask = tuple(np.asarray(part)[None] for part in initial_mask)
+    if table is not None:
+        scores, boards = _cached_cascades(board[None], table, initial_mask)
+    else:
+        scores, boards = evaluate_batch(board[None], initial_mask)
+    return int(scores[0]), boards[0]
+
+
+def move_cells(row, col, direction):
+    """Return ((r1, c1), (r2, c2)) for a 'right' or 'down' swap."""
+    if direction == "right":
+        return (row, col), (row, col + 1)
+    return (row, col), (row + 1, col)
+
+
+def _build_swap_table():
+    """List every adjacent swap in scan order as (row, col, direction)."""
+    swaps = []
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            if col < GRID_SIZE - 1:
+                swaps.append((row, col, "right"))
+            if row < GRID_SIZE - 1:
+                swaps.append((row, col, "down"))
+    return swaps
+
+
+# All 112 adjacent swaps, plus their cell coordinates as index arrays
+SWAPS = _build_swap_table()
+MOVES = [sum(move_cells(*swap), ()) for swap in SWAPS]
+SWAP_INDEX = {move: idx for idx, move in enumerate(MOVES)}
+_SWAP_R1, _SWAP_C1, _SWAP_R2, _SWAP_C2 = (np.array(axis) for axis in zip(*MOVES))
+_SWAP_ROWS = np.array([row for row, _, _ in SWAPS])
+
+
+def apply_swaps(boards, swap_idx):
+    """Apply one swap to each board of a (N, 8, 8) stack. Returns a new stack.
+
+    swap_idx: (N,) indices into SWAPS, one per board.
+    """
+    n = np.arange(len(boards))
+    r1, c1, r2, c2 = _SWAP_R1[swap_idx], _SWAP_C1[swap_idx], _SWAP_R2[swap_idx], _SWAP_C2[swap_idx]
+    swapped = boards.copy()
+    swapped[n, r1, c1] = boards[n, r2, c2]
+    swapped[n, r2, c2] = boards[n, r1, c1]
+    return swapped
+
+
+def _build_reach_tables():
+    """Precompute, per line pattern and cell, how far the cell's color run reaches.
+
+    reach[0][pattern, pos] counts the cells from pos back toward cell 0 that
+    share its color, pos included; reach[1] counts forward to the line's end.
+    """
+    reach = np.ones((2, 1 << (GRID_SIZE - 1), GRID_SIZE), dtype=np.uint8)
+    for pattern in range(reach.shape[1]):
+        for pos in range(GRID_SIZE):
+            bit = pos - 1
+            while bit >= 0 and pattern >> bit & 1:
+                reach[0, pattern, pos] += 1
+                bit -= 1
+            bit = pos
+            while bit < GRID_SIZE - 1 and pattern >> bit & 1:
+                reach[1, pattern, pos] += 1
+                bit += 1
+    return reach
+
+
+def _build_arm_tables():
+    """Precompute the neighbours each swapped gem can line up with.
+
+    Indexed (side, axis, end, swap): side 0 is the gem moved into the
+    swap's first cell, side 1 the gem moved into the second; axis 0 is the
+    row, 1 the column; end 0 looks toward index 0, end 1 away from it.
+    Returns the neighbour's flat cell index and the index of its reach in
+    that direction within a flattened (4, 65) run table. Off-board
+    neighbours and the swap partner point at the empty sentinel cell 64.
+    """
+    sentinel = GRID_SIZE * GRID_SIZE
+    cells = np.full((2, 2, 2, len(MOVES)), sentinel, dtype=np.intp)
+    for k, (r1, c1, r2, c2) in enumerate(MOVES):
+        for side, (row, col, partner) in enumerate(((r1, c1, (r2, c2)), (r2, c2, (r1, c1)))):
+            for axis, (dr, dc) in enumerate(((0, 1), (1, 0))):
+                for end, step in enumerate((-1, 1)):
+                    nr, nc = row + dr * step, col + dc * step
+                    if 0 <= nr < GRID_SIZE and 0 <= nc < GRID_SIZE and (nr, nc) != partner:
+                        cells[side, axis, end, k] = nr * GRID_SIZE + nc
+    direction = np.arange(4).reshape(1, 2, 2, 1)
+    return cells, direction * (sentinel + 1) + cells
+
+
+_REACH = _build_reach_tables()
+_ARM_CELL, _ARM_RUN = _build_arm_tables()
+_SWAP_CELL1 = _SWAP_R1 * GRID_SIZE + _SWAP_C1
+_SWAP_CELL2 = _SWAP_R2 * GRID_SIZE + _SWAP_C2
+
+
+def run_tables(boards):
+    """Build the run tables of a (N, 8, 8) stack. Returns (colors, runs).
+
+    colors: (N, 65) base color per flat cell; runs: (N, 4, 65) how many
+    cells each cell's color run reaches left, right, up and down, itself
+    included. Column 64 is an empty sentinel (color EMPTY, reach 0). Both
+    come from one _line_patterns pass, so rebuilding them after a cascade
+    costs about as much as one find_match_mask.
+    """
+    n = len(boards)
+    base = boards & BASE_MASK
+    reach = _REACH[:, _line_patterns(base)]  # (end, axis, N, line, pos)
+    reach = np.concatenate((reach[:, 0], np.swapaxes(reach[:, 1], -1, -2)))
+    colors = np.zeros((n, GRID_SIZE * GRID_SIZE + 1), dtype=np.uint8)
+    colors[:, :-1] = base.reshape(n, -1)
+    runs = np.zeros((n, 4, GRID_SIZE * GRID_SIZE + 1), dtype=np.uint8)
+    runs[:, :, :-1] = np.moveaxis(reach, 0, 1).reshape(n, 4, -1)
+    return colors, runs
+
+
+def swap_run_lengths(boards, tables=None):
+    """Longest line every swap forms through its two cells. Returns (112,) or (N, 112).
+
+    Each swap is answered in constant time from the run tables: the gem
+    moved into a cell lines up with every neighbour of its color, looking
+    away from the swap partner, and those neighbours' runs never pass
+    through the swapped cells, so the tables of the unswapped board stay
+    valid for all 112 swaps. A length of 3+ means the swap creates a match.
+    Swaps of empty cells, hypercubes or identical colors give 0. tables:
+    run_tables of the stack, if already built.
+    """
+    single = boards.ndim == 2
+    stack = boards[None] if single else boards
+    colors, runs = run_tables(stack) if tables is None else tables
+    b1, b2 = colors[:, _SWAP_CELL1], colors[:, _SWAP_CELL2]
+
+    moved = np.stack((b2, b1), axis=1)[:, :, None, None, :]
+    arm_runs = runs.reshape(len(stack), -1)[:, _ARM_RUN]
+    arms = np.where(colors[:, _ARM_CELL] == moved, arm_runs, 0)
+    lengths = (1 + arms.sum(axis=3, dtype=np.uint8)).max(axis=(1, 2))
+
+    regular = (b1 != b2) & (b1 != EMPTY) & (b2 != EMPTY) & (b1 != HYPERCUBE) & (b2 != HYPERCUBE)
+    lengths = np.where(regular, lengths, 0)
+    return lengths[0] if single else lengths
+
+
+def legal_swap_mask(boards):
+    """Check every swap on one board or a stack. Returns bool (112,) or (N, 112).
+
+    Same answer as calling swap_creates_match on every pair: empty cells
+    never swap, hypercubes always do, identical base colors never create a
+    match. Regular swaps are looked up in the run tables (swap_run_lengths)
+    rather than simulated.
+    """
+    single = boards.ndim == 2
+    stack = boards[None] if single else boards
+    tables = run_tables(stack)
+    colors = tables[0]
+    b1, b2 = colors[:, _SWAP_CELL1], colors[:, _SWAP_CELL2]
+    hypercube = ((b1 == HYPERCUBE) & (b2 != EMPTY)) | ((b2 == HYPERCUBE) & (b1 != EMPTY))
+    legal = hypercube | (swap_run_lengths(stack, tables) >= 3)
+    return legal[0] if single else legal
+
+
+def unsettled_moves(settled):
+    """Moves that could involve a cell that is still animating. Returns a set of moves.
+
+    settled: (8, 8) bool motion map, True where the cell has stopped moving.
+    A swap can only form lines through cells up to 2 steps along the row or
+    column of either swapped cell, so it is safe when that plus-shaped
+    neighborhood is settled. The result is in failed_moves format and can be
+    unioned with it.
+    """
+    animating = ~np.asarray(settled, dtype=bool)
+    near = animating.copy()
+    for step in (1, 2):
+        near[step:] |= animating[:-step]
+        near[:-step] |= animating[step:]
+        near[:, step:] |= animating[:, :-step]
+        near[:, :-step] |= animating[:, step:]
+    unsafe = near[_SWAP_R1, _SWAP_C1] | near[_SWAP_R2, _SWAP_C2]
+    return {MOVES[idx] for idx in np.flatnonzero(unsafe)}
+
+
+def cascade_depth(board, move):
+    """Number of match levels a move triggers on the known board (0 = none).
+
+    Cleared cells stay empty, so refills can only make the real cascade
+    longer; used to predict how long the animation will run.
+    """
+    current = apply_swaps(board[None], [SWAP_INDEX[move]])
+    levels = 0
+    while True:
+        h_mask, v_mask, _ = find_match_mask(current)
+        matched = h_mask | v_mask
+        if not matched.any():
+            return levels
+        current = apply_gravity(np.where(matched, np.uint8(EMPTY), current))
+        levels += 1
+
+
+def swap_rows(swap_idx):
+    """Row of the first cell of each swap (for the BOTTOM_ROW_BONUS tiebreaker)."""
+    return _SWAP_ROWS[swap_idx]
+
+
+def score_hypercube_swaps(boards, swap_idx, table=None):
+    """Simulate hypercube swaps on a (N, 8, 8) stack. Returns (scores, resulting_boards).
+
+    The hypercube destroys every gem of the color it is swapped with (every
+    gem when swapped with another hypercube), scoring DETONATED_GEM_SCORE
+    per gem. With SPECIAL_RULES, specials caught in the wipe detonate in
+    turn; empty cells their blasts sweep score nothing. Gravity and the
+    cascades that follow are scored as in evaluate_batch, starting at
+    cascade level 1. Expects only hypercube swaps (see is_hypercube_swap).
+    table: optional TranspositionTable memoizing the cascade after each wipe.
+    """
+    n = np.arange(len(boards))
+    r1, c1, r2, c2 = _SWAP_R1[swap_idx], _SWAP_C1[swap_idx], _SWAP_R2[swap_idx], _SWAP_C2[swap_idx]
+    base = boards & BASE_MASK
+    b1, b2 = base[n, r1, c1], base[n, r2, c2]
+    target = np.where(b1 == HYPERCUBE, b2, b1)
+
+    cubes = np.zeros(boards.shape, dtype=bool)
+    cubes[n, r1, c1] = b1 == HYPERCUBE
+    cubes[n, r2, c2] |= b2 == HYPERCUBE
+    both = target == HYPERCUBE
+    cleared = (base == target[:, None, None]) | (both[:, None, None] & (base != EMPTY)) | cubes
+    if SPECIAL_RULES:
+        cleared = _detonate(boards, base, cleared, cubes)
+
+    scores = np.count_nonzero(cleared & (base != EMPTY), axis=(1, 2)) * DETONATED_GEM_SCORE
+    dropped = apply_gravity(np.where(cleared, np.uint8(EMPTY), boards))
+    if table is not None:
+        cascade_scores, resulting = _cached_cascades(dropped, table, kind=TT_WIPE, cascade_level=1)
+    else:
+        cascade_scores, resulting = evaluate_batch(dropped, cascade_level=1)
+    return scores + cascade_scores, resulting
+
+
+def hoarded_swaps(boards, swap_idx, scores):
+    """Hypercube swaps the hoarding policy keeps back (scored HYPERCUBE_SWAP_SCORE).
+
+    These are never expanded by the look-ahead.
+    """
+    return is_hypercube_swap(boards, swap_idx) & (scores <= HYPERCUBE_SWAP_SCORE)
+
+
+def is_hypercube_swap(boards, swap_idx):
+    """Check, for one swap per board of a (N, 8, 8) stack, if it moves a hypercube."""
+    n = np.arange(len(boards))
+    src = boards[n, _SWAP_R1[swap_idx], _SWAP_C1[swap_idx]] & BASE_MASK
+    dst = boards[n, _SWAP_R2[swap_idx], _SWAP_C2[swap_idx]] & BASE_MASK
+    return (src == HYPERCUBE) | (dst == HYPERCUBE)
+
+
+def _special_bonus(gems, in_match):
+    """FLAME_MATCH_BONUS / STAR_MATCH_BONUS for swapped gems that joined a match."""
+    bonus = np.where(gems & FLAME_FLAG, FLAME_MATCH_BONUS,
+                     np.where(gems & STAR_FLAG, STAR_MATCH_BONUS, 0))
+    return np.where(in_match, bonus, 0)
+
+
+def score_swaps(boards, swap_idx, table=None):
+    """Score one swap per board on a (N, 8, 8) stack. Returns (scores, resulting_boards).
+
+    Mirrors bejeweled._score_swap for all N boards at once: cascades are
+    simulated together. Hypercube swaps are simulated (score_hypercube_swaps)
+    with HYPERCUBE_SIMULATE, and score HYPERCUBE_SWAP_SCORE when hoarded:
+    the wipe is worth less than HYPERCUBE_HOARD_BELOW, or not simulated. With
+    SPECIAL_RULES the cascades create and detonate special gems
+    (resolve_matches); without, flat flame/star bonuses apply when the
+    swapped special gem is part of an initial match. table: optional
+    TranspositionTable memoizing the cascade of each post-swap board.
+    """
+    n = np.arange(len(boards))
+    r1, c1, r2, c2 = _SWAP_R1[swap_idx], _SWAP_C1[swap_idx], _SWAP_R2[swap_idx], _SWAP_C2[swap_idx]
+    src, dst = boards[n, r1, c1], boards[n, r2, c2]
+
+    swapped = apply_swaps(boards, swap_idx)
+    initial = find_match_mask(swapped)
+    swap_cells = np.stack((r1, c1, r2, c2))
+    if table is not None:
+        scores, resulting = _cached_cascades(swapped, table, initial, swap_cells)
+    else:
+        scores, resulting = evaluate_batch(swapped, initial_mask=initial, swap_cells=swap_cells)
+
+    if not SPECIAL_RULES:
+        # After the swap src sits at (r2, c2) and dst at (r1, c1)
+        matched = initial[0] | initial[1]
+        bonus = _special_bonus(src, matched[n, r2, c2]) + _special_bonus(dst, matched[n, r1, c1])
+        scores = np.where(scores > 0, scores + bonus, scores)
+    hypercube = is_hypercube_swap(boards, swap_idx)
+    scores = np.where(hypercube, HYPERCUBE_SWAP_SCORE, scores)
+    if HYPERCUBE_SIMULATE and hypercube.any():
+        cube_scores, cube_boards = score_hypercube_swaps(
+            boards[hypercube], swap_idx[hypercube], table
+        )
+        scores[hypercube] = np.where(
+            cube_scores < HYPERCUBE_HOARD_BELOW, HYPERCUBE_SWAP_SCORE, cube_scores
+        )
+        resulting[hypercube] = cube_boards
+    return scores, resulting
+
+
+def score_swap(board, row, col, direction):
+    """Score a swap on a board copy. Returns (score, resulting_board).
+
+    Single-board form of score_swaps, mirroring bejeweled._score_swap.
+    """
+    idx = SWAP_INDEX[sum(move_cells(row, col, direction), ())]
+    scores, resulting = score_swaps(board[None], np.array([idx]))
+    return int(scores[0]), resulting[0]
+
+
+
+def swap_creates_match(board, r1, c1, r2, c2):
+    """Check if swapping (r1,c1) with (r2,c2) forms a match through either cell.
+
+    Same rules as bejeweled.swap_creates_match: empty cells never swap,
+    hypercubes always do, and identical base colors never create a match.
+    """
+    b1, b2 = int(board[r1, c1]) & BASE_MASK, int(board[r2, c2]) & BASE_MASK
+    if not b1 or not b2:
+        return False
+    if b1 == HYPERCUBE or b2 == HYPERCUBE:
+        return True
+    if b1 == b2:
+        return False
+    swapped = board.copy()
+    swapped[r1, c1], swapped[r2, c2] = board[r2, c2], board[r1, c1]
+    h_mask, v_mask, _ = find_match_mask(swapped)
+    matched = h_mask | v_mask
+    return bool(matched[r1, c1] or matched[r2, c2])
+
+
+def best_next_scores(boards, table=None):
+    """Find the best single-move score on each board of a (N, 8, 8) stack.
+
+    All legal follow-up swaps across the whole stack are scored in one
+    score_swaps call, then reduced to a per-board maximum. table: optional
+    TranspositionTable; boards already seen skip the search entirely.
+    """
+    if table is not None:
+        keys, values, miss_idx = table.lookup_batch(TT_NEXT, boards)
+        if miss_idx.size:
+            computed = best_next_scores(boards[miss_idx]).tolist()
+            table.store_batch(TT_NEXT, keys, values, miss_idx, computed)
+        return np.array(values, dtype=np.int64)
+
+    best = np.zeros(len(boards), dtype=np.int64)
+    board_idx, swap_idx = np.nonzero(legal_swap_mask(boards))
+    if board_idx.size:
+        scores, _ = score_swaps(boards[board_idx], swap_idx)
+        np.maximum.at(best, board_idx, scores)
+    return best
+
+
+def best_next_score(board, table=None):
+    """Find the best single-move score on a board state (for look-ahead)."""
+    return int(best_next_scores(board[None], table)[0])
+
+
+def evaluate_moves(board, swap_idx, table=None):
+    """Evaluate several moves with 2-step look-ahead. Returns an (N,) score array.
+
+    Batched form of evaluate_move: step 1 for every candidate runs as one
+    stacked cascade simulation, and the follow-up search over every
+    resulting board runs as one more. table: optional TranspositionTable
+    shared by both steps.
+    """
+    swap_idx = np.asarray(swap_idx, dtype=np.intp)
+    boards = np.repeat(board[None], len(swap_idx), axis=0)
+    step1, resulting = score_swaps(boards, swap_idx, table)
+
+    # Hoarded hypercube swaps keep their last-resort score and skip the
+    # look-ahead; swaps with no immediate match are rejected by the game (score 0).
+    expand = ~hoarded_swaps(boards, swap_idx, step1) & (step1 > 0)
+
+    totals = step1.copy()
+    if expand.any():
+        step2 = best_next_scores(resulting[expand], table)
+        totals[expand] += step2 * 2 // 3 + swap_rows(swap_idx[expand]) * BOTTOM_ROW_BONUS
+    return totals
+
+
+def evaluate_move(board, row, col, direction, table=None):
+    """Evaluate a move with 2-step look-ahead. Returns (score, move_tuple).
+
+    Same scoring as bejeweled.evaluate_move, run on the integer board.
+    """
+    move = sum(move_cells(row, col, direction), ())
+    return int(evaluate_moves(board, [SWAP_INDEX[move]], table)[0]), move
+
+
+def find_optimal_move(color_grid, failed_moves=None, table=None):
+    """Find the move producing the highest score. Returns (move_tuple, score) or (None, 0).
+
+    Drop-in replacement for bejeweled.find_optimal_move that accepts either
+    a color-name grid or an already encoded board. Every legal candidate is
+    scored in one evaluate_moves batch; ties go to the first move in scan
+    order, as in the list engine. table: optional TranspositionTable kept
+    across frames of the same game.
+    """
+    if failed_moves is None:
+        failed_moves = set()
+    board = color_grid if isinstance(color_grid, np.ndarray) else encode_grid(color_grid)
+
+    candidates = [
+        idx for idx in np.flatnonzero(legal_swap_mask(board))
+        if MOVES[idx] not in failed_moves
+    ]
+    if not candidates:
+        return None, 0
+    scores = evaluate_moves(board, candidates, table)
+    best = int(np.argmax(scores))
+    if scores[best] <= 0:
+        return None, 0
+    return MOVES[candidates[best]], int(scores[best])
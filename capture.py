@@ -0,0 +1,418 @@
+"""
+Frame sources and background screen capture for BejeweledBot.
+
+A FrameSource is where capture_raw gets its frames: ScreenSource grabs the
+live screen with mss, and the replay sources (PngDirectorySource,
+NpzSessionSource) hand out recorded frames so the whole bot can run headless,
+e.g. on a Linux box, at full speed or paced to the recording. Session files
+written by bejeweled.py --session replay directly (SessionSource). Pack a
+directory of recorded frames (bejeweled.py --record-dir) into one session
+file with:
+
+    python capture.py pack <frame_dir> <session.npz>
+
+capture_raw used to grab the grid synchronously, so every stability poll,
+scan and double-scan paid the full grab latency on the critical path. Here a
+producer thread grabs the grid region at a fixed rate into a small ring of
+preallocated frames. Consumers copy out the most recent frame without
+waiting for a grab. Each frame carries its capture timestamp and sequence
+number. The thread counts ticks it missed (grab slower than the rate) and
+frames nobody read before newer ones replaced them.
+
+Grabs are wrapped as NumPy views of the mss buffer (no np.array copy) and
+converted BGRA -> BGR straight into their destination. Full-frame passes
+and frame-size allocations are counted per pipeline stage (frame_passes,
+frame_allocs) so copies per frame can be measured.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+import session
+
+try:
+    import mss
+
+    HAS_MSS = True
+except ImportError:
+    HAS_MSS = False
+
+CAPTURE_FPS = 60  # Target grabs per second
+CAPTURE_RING = 4  # Preallocated frames in the ring
+CAPTURE_FRAME_TIMEOUT = 2.0  # Seconds a reader waits for a new frame
+PNG_FRAME_INTERVAL = 0.5  # Seconds between PNG frames whose names carry no timestamp
+
+# Full-frame passes and frame-size allocations per pipeline stage
+frame_passes = Counter()
+frame_allocs = Counter()
+
+
+def shot_view(shot):
+    """View an mss ScreenShot as a (height, width, 4) BGRA array without copying."""
+    return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+
+def convert_into(src, code, out, stage):
+    """cv2.cvtColor to a 3-channel frame in out when it fits (else a new array). Counts the pass.
+
+    Returns the converted frame; callers keep it as their buffer for the
+    next call.
+    """
+    shape = src.shape[:2] + (3,)
+    if out is None or out.shape != shape:
+        out = np.empty(shape, dtype=np.uint8)
+        frame_allocs[stage] += 1
+    cv2.cvtColor(src, code, dst=out)
+    frame_passes[stage] += 1
+    return out
+
+
+def copy_into(src, out, stage):
+    """np.copyto into out when it fits (else a new array). Counts the pass."""
+    if out is None or out.shape != src.shape:
+        out = np.empty_like(src)
+        frame_allocs[stage] += 1
+    np.copyto(out, src)
+    frame_passes[stage] += 1
+    return out
+
+
+def grab_bgr(sct, region, out=None):
+    """Grab a region as BGR into out: one pass over the pixels, no temporaries."""
+    return convert_into(shot_view(sct.grab(region)), cv2.COLOR_BGRA2BGR, out, "grab")
+
+
+def pipeline_stats(frames):
+    """Full-frame passes and allocations per processed frame, as a short log string."""
+    if not frames:
+        return "no frames"
+    passes = ", ".join(f"{stage} {n / frames:.2f}" for stage, n in sorted(frame_passes.items()))
+    allocs = ", ".join(f"{stage} {n}" for stage, n in sorted(frame_allocs.items()))
+    return f"passes/frame: {passes or 'none'}; frame allocations: {allocs or 'none'}"
+
+
+class CaptureThread:
+    """Producer thread filling a ring of preallocated BGR frames with screen grabs.
+
+    top_left, bottom_right: grid corners in screen coordinates. The ring is
+    allocated from the first grab (its size depends on DPI scaling). Reads
+    use a per-slot sequence number as a seqlock: a reader copies the newest
+    slot and retries if the producer started overwriting it meanwhile, so
+    the producer never blocks; a reader only waits when it asks for a frame
+    newer than one it already has. If a grab raises, the thread stops and
+    error holds the exception, which latest() re-raises.
+    """
+
+    def __init__(self, top_left, bottom_right, fps=CAPTURE_FPS, ring_size=CAPTURE_RING):
+        self.region = {
+            "left": top_left[0],
+            "top": top_left[1],
+            "width": bottom_right[0] - top_left[0],
+            "height": bottom_right[1] - top_left[1],
+        }
+        self.interval = 1.0 / fps
+        self.ring_size = ring_size
+        self._frames = None
+        self._timestamps = np.zeros(ring_size)
+        self._slot_seq = [-1] * ring_size
+        self._seq = -1  # Sequence number of the newest complete frame
+        self._last_read = -1
+        self._new_frame = threading.Condition()
+        self.error = None  # Exception that stopped the producer, if any
+        self._stop = threading.Event()
+        self.captured = 0
+        self.missed = 0  # Ticks lost because a grab overran the interval
+        self.unread = 0  # Frames replaced before any consumer read them
+        self._grab_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def matches(self, top_left, bottom_right):
+        """Check if this thread captures exactly the given region."""
+        return (
+            self.region["left"] == top_left[0]
+            and self.region["top"] == top_left[1]
+            and self.region["width"] == bottom_right[0] - top_left[0]
+            and self.region["height"] == bottom_right[1] - top_left[1]
+        )
+
+    def _run(self):
+        try:
+            self._produce()
+        except Exception as exc:
+            self.error = exc
+            with self._new_frame:
+                self._new_frame.notify_all()
+
+    def _produce(self):
+        # mss handles are per thread, so the producer opens its own
+        with mss.mss() as sct:
+            next_tick = time.perf_counter()
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                shot = shot_view(sct.grab(self.region))
+                timestamp = time.time()
+                if self._frames is None:
+                    height, width = shot.shape[:2]
+                    self._frames = np.empty((self.ring_size, height, width, 3), dtype=np.uint8)
+                    frame_allocs["ring"] += self.ring_size
+
+                seq = self._seq + 1
+                slot = seq % self.ring_size
+                self._slot_seq[slot] = -1  # Readers of this slot must retry
+                convert_into(shot, cv2.COLOR_BGRA2BGR, self._frames[slot], "grab")
+                self._timestamps[slot] = timestamp
+                self._slot_seq[slot] = seq
+                with self._new_frame:
+                    self._seq = seq
+                    self._new_frame.notify_all()
+                self.captured += 1
+                self._grab_seconds += time.perf_counter() - start
+
+                next_tick += self.interval
+                now = time.perf_counter()
+                if now > next_tick:
+                    lost = int((now - next_tick) / self.interval) + 1
+                    self.missed += lost
+                    next_tick += lost * self.interval
+                self._stop.wait(max(0.0, next_tick - time.perf_counter()))
+
+    def latest(self, out=None, newer_than=-1):
+        """Copy the newest frame. Returns (frame, timestamp, seq).
+
+        out: optional preallocated array to copy into (reused by the caller).
+        newer_than: the seq of the last frame the caller used; blocks until
+        the producer has grabbed a later one (always true once the first
+        frame is in with the default). Raises RuntimeError if the producer
+        died, TimeoutError if no new frame arrives in CAPTURE_FRAME_TIMEOUT.
+        """
+        with self._new_frame:
+            self._new_frame.wait_for(
+                lambda: self._seq > newer_than or self.error is not None, CAPTURE_FRAME_TIMEOUT
+            )
+        if self._seq <= newer_than:
+            if self.error is not None:
+                raise RuntimeError(f"Capture thread stopped: {self.error!r}") from self.error
+            raise TimeoutError(f"No frame captured after seq {newer_than}")
+        while True:
+            seq = self._seq
+            slot = seq % self.ring_size
+            out = copy_into(self._frames[slot], out, "read")
+            timestamp = self._timestamps[slot]
+            if self._slot_seq[slot] == seq:
+                break
+        if seq > self._last_read:
+            self.unread += max(0, seq - self._last_read - 1)
+            self._last_read = seq
+        return out, timestamp, seq
+
+    def stats(self):
+        """Capture rate and drop counters as a short log string."""
+        grab_ms = self._grab_seconds / self.captured * 1000 if self.captured else 0.0
+        stats = (
+            f"{self.captured} frames ({grab_ms:.1f}ms/grab), {self.missed} missed ticks, "
+            f"{self.unread} unread"
+        )
+        if self.error is not None:
+            stats += f", stopped by {self.error!r}"
+        return stats
+
+
+class FrameSource:
+    """Where frames come from. grab() returns the grid region as a BGR frame.
+
+    Live sources grab whatever is on screen now; recorded sources step
+    through their frames with advance(), one per main loop iteration, and
+    ignore the region (their frames already show just the grid).
+    """
+
+    live = True
+
+    def grab(self, region, out=None):
+        """Return the grid region as BGR, written into out when it fits."""
+        raise NotImplementedError
+
+    def advance(self):
+        """Move to the next recorded frame. Returns False once the recording ends."""
+        return True
+
+    def now(self):
+        """Current time on the source's clock (recording time for replays)."""
+        return time.time()
+
+    def close(self):
+        pass
+
+
+class ScreenSource(FrameSource):
+    """Live screen grabs through mss."""
+
+    def __init__(self):
+        if not HAS_MSS:
+            raise RuntimeError("Live capture needs the mss package (pip install mss)")
+        self._sct = mss.mss()
+
+    def grab(self, region, out=None):
+        return grab_bgr(self._sct, region, out)
+
+    def close(self):
+        self._sct.close()
+
+
+class ReplaySource(FrameSource):
+    """Recorded frames with timestamps, replayed one frame per advance().
+
+    speed: 0 replays as fast as the consumer goes; otherwise advance()
+    sleeps so frames appear at speed times their recorded pace.
+    """
+
+    live = False
+
+    def __init__(self, timestamps, speed=0.0):
+        self.timestamps = np.asarray(timestamps, dtype=float)
+        self.speed = speed
+        self.index = -1
+        self._wall_start = None
+        self._cached = (None, None)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _load(self, index):
+        raise NotImplementedError
+
+    def frame(self, index):
+        """Decoded frame at index (the last one is cached)."""
+        if self._cached[0] != index:
+            self._cached = (index, self._load(index))
+        return self._cached[1]
+
+    def frame_size(self):
+        """(width, height) of the recorded frames."""
+        height, width = self.frame(max(self.index, 0)).shape[:2]
+        return width, height
+
+    def advance(self):
+        if self.index + 1 >= len(self):
+            return False
+        self.index += 1
+        if self.speed > 0:
+            if self._wall_start is None:
+                self._wall_start = time.time()
+            due = self._wall_start + (self.timestamps[self.index] - self.timestamps[0]) / self.speed
+            time.sleep(max(0.0, due - time.time()))
+        return True
+
+    def now(self):
+        return float(self.timestamps[max(self.index, 0)])
+
+    def grab(self, region, out=None):
+        return copy_into(self.frame(max(self.index, 0)), out, "read")
+
+
+class PngDirectorySource(ReplaySource):
+    """A directory of frame PNGs, replayed in name order.
+
+    Names like 000042_1712345678.123.png (as written by
+    bejeweled.py --record-dir) give the capture time; other names are spaced
+    PNG_FRAME_INTERVAL apart.
+    """
+
+    def __init__(self, path, speed=0.0):
+        self.paths = [
+            os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".png")
+        ]
+        if not self.paths:
+            raise ValueError(f"No PNG frames in {path}")
+        stamps = [_name_timestamp(p) for p in self.paths]
+        if None in stamps:
+            stamps = [i * PNG_FRAME_INTERVAL for i in range(len(self.paths))]
+        super().__init__(stamps, speed)
+
+    def _load(self, index):
+        frame = cv2.imread(self.paths[index])
+        if frame is None:
+            raise ValueError(f"Unreadable frame {self.paths[index]}")
+        return frame
+
+
+class NpzSessionSource(ReplaySource):
+    """A packed session file: PNG-encoded frames back to back, plus offsets and timestamps."""
+
+    def __init__(self, path, speed=0.0):
+        with np.load(path) as data:
+            self._blob = data["blob"]
+            self._offsets = data["offsets"]
+            timestamps = data["timestamps"]
+        super().__init__(timestamps, speed)
+
+    def _load(self, index):
+        encoded = self._blob[self._offsets[index] : self._offsets[index + 1]]
+        return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+class SessionSource(ReplaySource):
+    """The frames of a session file (session.py); records stored without a frame are skipped."""
+
+    def __init__(self, path, speed=0.0):
+        self.reader = session.SessionReader(path)
+        self._records = np.flatnonzero(self.reader.records["frame_len"])
+        super().__init__(self.reader.timestamps[self._records], speed)
+
+    def _load(self, index):
+        return self.reader.frame(self._records[index])
+
+    def close(self):
+        self._cached = (None, None)
+        self.reader.close()
+
+
+def _name_timestamp(path):
+    match = re.match(r"\d+_(\d+(?:\.\d+)?)\.png$", os.path.basename(path))
+    return float(match.group(1)) if match else None
+
+
+def pack_session(frame_dir, path):
+    """Pack a directory of frame PNGs into one session file. Returns the frame count."""
+    source = PngDirectorySource(frame_dir)
+    chunks = []
+    for frame_path in source.paths:
+        with open(frame_path, "rb") as f:
+            chunks.append(np.frombuffer(f.read(), dtype=np.uint8))
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in chunks])])
+    np.savez(path, blob=np.concatenate(chunks), offsets=offsets, timestamps=source.timestamps)
+    return len(chunks)
+
+
+def open_source(path=None, speed=0.0):
+    """Frame source for a replay path (frame directory, session or .npz file), or the screen."""
+    if path is None:
+        return ScreenSource()
+    if os.path.isdir(path):
+        return PngDirectorySource(path, speed)
+    if path.endswith(session.SESSION_EXT):
+        return SessionSource(path, speed)
+    return NpzSessionSource(path, speed)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 4 or sys.argv[1] != "pack":
+        print("Usage: python capture.py pack <frame_dir> <session.npz>")
+        sys.exit(1)
+    count = pack_session(sys.argv[2], sys.argv[3])
+    print(f"Packed {count} frames into {sys.argv[3]}")
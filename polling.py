@@ -0,0 +1,122 @@
+"""
+Adaptive stability polling for BejeweledBot.
+
+With a fixed schedule, the bot polls the board every STABILITY_DELAY seconds
+after every move, whatever the move did. A plain swap settles in a fraction
+of that, and a long cascade costs many useless polls. This module learns how
+long each kind of event takes to settle, from the bot's own frame diffs.
+Event kinds are a plain swap and a swap with N predicted cascade levels. The
+learned times become a polling schedule: sleep through most of the expected
+animation, then poll quickly until the board holds still, backing off if it
+keeps moving.
+
+Every wait is also recorded next to the latency the fixed schedule would
+have had for the same animation, so the saving can be logged as histograms.
+"""
+
+import itertools
+import math
+from collections import defaultdict, deque
+
+import numpy as np
+
+SETTLE_HISTORY = 50  # Settle times remembered per event type
+SETTLE_MIN_SAMPLES = 3  # Fewer samples than this: keep the fixed schedule
+SETTLE_QUANTILE = 0.25  # First frame is taken at this quantile of past settle times
+SETTLE_SHRINK = 0.9  # Stable at the first look: record a shorter time to probe lower
+POLL_MIN_INTERVAL = 0.03  # Fastest poll interval after the first frame (s)
+POLL_BACKOFF = 1.5  # Interval growth per poll while the board keeps moving
+HISTOGRAM_BIN = 0.1  # Latency histogram bin width (s)
+HISTOGRAM_BINS = 30  # Bins before the overflow bin (3s at 100ms bins)
+
+
+def event_type(cascade_levels):
+    """Name the event for a move expected to match cascade_levels times."""
+    if cascade_levels <= 1:
+        return "swap"
+    if cascade_levels >= 4:
+        return "cascade4+"
+    return f"cascade{cascade_levels}"
+
+
+def fixed_latency(settle, interval):
+    """Latency of the fixed schedule for an animation lasting settle seconds.
+
+    The fixed schedule grabs a frame at once, then one every interval
+    seconds, and needs two consecutive frames that both come after the
+    animation ended.
+    """
+    return (math.ceil(settle / interval) + 1) * interval
+
+
+def _histogram(latencies):
+    """Counts per HISTOGRAM_BIN, the last bin collecting everything beyond."""
+    bins = np.minimum((np.asarray(latencies) / HISTOGRAM_BIN).astype(int), HISTOGRAM_BINS)
+    return np.bincount(bins, minlength=HISTOGRAM_BINS + 1)
+
+
+class SettleModel:
+    """Learned settle times per event type, plus the latency record for reporting.
+
+    fixed_interval: the fixed poll interval (STABILITY_DELAY); used as-is for
+    events without enough history, as the cap on backed-off intervals, and
+    as the baseline of the latency report.
+    """
+
+    def __init__(self, fixed_interval):
+        self.fixed_interval = fixed_interval
+        self.settle_times = defaultdict(lambda: deque(maxlen=SETTLE_HISTORY))
+        self.latencies = defaultdict(list)  # event -> [(adaptive, fixed), ...]
+
+    def schedule(self, event):
+        """Return (first_delay, intervals) for waiting on an event.
+
+        first_delay: seconds after the event before the first frame is
+        taken. intervals: iterator of sleeps between later frames.
+        """
+        times = self.settle_times.get(event, ())
+        if len(times) < SETTLE_MIN_SAMPLES:
+            return 0.0, itertools.repeat(self.fixed_interval)
+        first_delay = float(np.quantile(times, SETTLE_QUANTILE))
+        return first_delay, self._backoff()
+
+    def _backoff(self):
+        interval = POLL_MIN_INTERVAL
+        while True:
+            yield interval
+            interval = min(interval * POLL_BACKOFF, self.fixed_interval)
+
+    def record(self, event, since, last_motion, stable_from, done):
+        """Feed back one finished wait (all arguments are time.time() stamps).
+
+        last_motion: capture time of the last frame that still differed from
+        its predecessor (None if the first comparison was already stable).
+        stable_from: capture time of the first frame of the stable pair.
+        done: when the wait returned.
+        """
+        if last_motion is None:
+            settle = (stable_from - since) * SETTLE_SHRINK
+        else:
+            settle = ((last_motion + stable_from) / 2) - since
+        settle = max(settle, 0.0)
+        self.settle_times[event].append(settle)
+        self.latencies[event].append((done - since, fixed_latency(settle, self.fixed_interval)))
+
+    def record_latency(self, event, adaptive, fixed):
+        """Record a wait whose fixed-schedule latency is known directly (e.g. a click delay)."""
+        self.latencies[event].append((adaptive, fixed))
+
+    def report(self):
+        """Per-event latency summary and histograms, adaptive vs fixed, as log text."""
+        lines = [f"Latency histograms ({HISTOGRAM_BIN * 1000:.0f}ms bins, last bin = overflow):"]
+        for event in sorted(self.latencies):
+            adaptive, fixed = np.array(self.latencies[event]).T
+            lines.append(
+                f"  {event}: n={len(adaptive)} adaptive {adaptive.mean() * 1000:.0f}ms "
+                f"(p90 {np.percentile(adaptive, 90) * 1000:.0f}ms) vs fixed "
+                f"{fixed.mean() * 1000:.0f}ms (p90 {np.percentile(fixed, 90) * 1000:.0f}ms), "
+                f"saved {fixed.sum() - adaptive.sum():.1f}s"
+            )
+            lines.append("    adaptive " + " ".join(str(c) for c in _histogram(adaptive)))
+            lines.append("    fixed    " + " ".join(str(c) for c in _histogram(fixed)))
+        return "\n".join(lines)
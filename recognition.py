@@ -0,0 +1,523 @@
+"""
+Vectorized gem recognition for BejeweledBot.
+
+The per-cell classifier in bejeweled.py (identify_cell_color/classify_special)
+slices the HSV image and runs its own reductions for every one of the 64
+cells. This module reshapes the grid HSV image into an
+(8, cell_h, 8, cell_w, 3) view (row, y, col, x, channel) and computes the
+border and center statistics for all cells in a handful of whole-grid NumPy
+reductions over the y/x axes. Only the rare cells with a glowing
+border (special gem candidates) fall back to per-cell hue statistics. The
+labels are the same as the per-cell path.
+
+GridGeometry caches the cell layout (slices, border mask, center windows,
+click centers) per grid position and capture size, so neither path
+rebuilds it per frame.
+
+classify_subsampled runs the same classifier on a fixed strided sample of
+each cell. Run this module as a script to compare its labels with the
+full-resolution ones on the reviewed gem_library:
+
+    python recognition.py [library_dir] [side]
+"""
+
+import os
+from collections import Counter
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from board import GRID_SIZE
+
+# HSV hue ranges for gem classification (OpenCV: H=0-179)
+# Red wraps around 0/179, handled separately in classify_hue
+GEM_HUE_RANGES = [
+    (8, 20, "orange"),
+    (20, 35, "yellow"),
+    (35, 85, "green"),
+    (85, 125, "blue"),
+    (125, 170, "purple"),
+]
+
+# HSV thresholds for pixel filtering
+MIN_SATURATION = 80
+MIN_VALUE = 80
+WHITE_MAX_SAT = 50
+WHITE_MIN_VAL = 180
+MIN_COLOR_RATIO = 0.10  # At least 10% of center region must be colorful
+
+# Special gem detection thresholds (calibrated from gem_library captures)
+SPECIAL_BORDER_V_THRESHOLD = 130  # Regular max 104, special min 140 (raised from 120 to avoid hint glow)
+HYPERCUBE_BORDER_V_THRESHOLD = 150  # Hypercube 166, hint glow ~125-145 (extra check to prevent false positives)
+HYPERCUBE_BORDER_S_THRESHOLD = 90  # Hypercube 73, next lowest 102
+FLAME_HUE_STD_THRESHOLD = 35  # Flame min 43, star max 30
+
+# Subsampled recognition: pixels sampled per cell side (24 -> 576 of ~22k
+# pixels per cell at 1920x1200). Strided, not averaged, so the hue spread
+# that separates flames from stars survives.
+SUBSAMPLE_SIDE = 24
+
+# Per-cell change detection between frames (incremental recognition)
+SIGNATURE_SIDE = 16  # Strided sample per cell side used as the cell's signature
+CHANGE_PIXEL_DELTA = 24  # A sampled pixel changed if any channel moved this much
+CHANGE_MIN_PIXELS = 5  # Cell changed if at least this many sampled pixels changed
+
+# Frame comparison for stability checks (FrameDiffer)
+DIFF_STRIDE = 1  # Compare every Nth pixel per axis (2 = a quarter of the pixels)
+DIFF_GRAY = False  # Compare only the green channel instead of all of BGR
+
+
+def classify_hue(hue):
+    """Classify an HSV hue value into a gem color name."""
+    if hue < 8 or hue >= 170:
+        return "red"
+    for low, high, name in GEM_HUE_RANGES:
+        if low <= hue < high:
+            return name
+
+
+# Hue -> color name for every 8-bit hue value
+_HUE_NAMES = np.array([classify_hue(hue) or "" for hue in range(256)], dtype=object)
+
+
+class GridGeometry:
+    """Cell layout of the grid, computed once per grid position and capture size.
+
+    Holds everything the hot loop used to recompute per cell and per frame:
+    image-space cell size and slices, the border mask and center windows used
+    by the classifiers, and the screen-space click center of every cell.
+
+    top_left, bottom_right: grid corners in screen coordinates.
+    image_size: (width, height) of captured frames; defaults to the region
+    size (differs only if the capture is DPI-scaled).
+    """
+
+    def __init__(self, top_left, bottom_right, image_size=None):
+        self.top_left = tuple(top_left)
+        self.bottom_right = tuple(bottom_right)
+        if image_size is None:
+            image_size = (bottom_right[0] - top_left[0], bottom_right[1] - top_left[1])
+        self.image_size = tuple(image_size)
+
+        # Image space: integer cell size, leftover pixels at right/bottom ignored
+        width, height = self.image_size
+        self.cell_w = width // GRID_SIZE
+        self.cell_h = height // GRID_SIZE
+        self.cell_slices = [
+            [
+                (slice(row * self.cell_h, (row + 1) * self.cell_h),
+                 slice(col * self.cell_w, (col + 1) * self.cell_w))
+                for col in range(GRID_SIZE)
+            ]
+            for row in range(GRID_SIZE)
+        ]
+
+        # Special gem windows: border = everything outside the center 50%
+        cell_h, cell_w = self.cell_h, self.cell_w
+        self.special_center = (
+            slice(cell_h // 4, cell_h * 3 // 4), slice(cell_w // 4, cell_w * 3 // 4),
+        )
+        self.border_mask = np.ones((cell_h, cell_w), dtype=bool)
+        self.border_mask[self.special_center] = False
+        self.border_count = int(np.count_nonzero(self.border_mask))
+
+        # Color window: center 50%, trimmed symmetrically (identify_cell_color)
+        self.color_center = (
+            slice(cell_h // 4, cell_h - cell_h // 4), slice(cell_w // 4, cell_w - cell_w // 4),
+        )
+
+        # Screen space: float cell size so clicks land mid-cell at any DPI
+        screen_w = (self.bottom_right[0] - self.top_left[0]) / GRID_SIZE
+        screen_h = (self.bottom_right[1] - self.top_left[1]) / GRID_SIZE
+        self.click_centers = [
+            [
+                (int(self.top_left[0] + col * screen_w + screen_w / 2),
+                 int(self.top_left[1] + row * screen_h + screen_h / 2))
+                for col in range(GRID_SIZE)
+            ]
+            for row in range(GRID_SIZE)
+        ]
+
+    def cell_box(self, row, col):
+        """Screen corners ((x0, y0), (x1, y1)) of one cell, for capturing just that cell."""
+        screen_w = (self.bottom_right[0] - self.top_left[0]) / GRID_SIZE
+        screen_h = (self.bottom_right[1] - self.top_left[1]) / GRID_SIZE
+        x0 = int(self.top_left[0] + col * screen_w)
+        y0 = int(self.top_left[1] + row * screen_h)
+        return (x0, y0), (int(x0 + screen_w), int(y0 + screen_h))
+
+    def cell(self, image, row, col):
+        """Slice one cell out of a grid image (a view, no copy)."""
+        return image[self.cell_slices[row][col]]
+
+    def for_image(self, image):
+        """Return a geometry matching this image's size (self when it already does)."""
+        size = (image.shape[1], image.shape[0])
+        if size == self.image_size:
+            return self
+        return grid_geometry(self.top_left, self.bottom_right, size)
+
+
+@lru_cache(maxsize=8)
+def grid_geometry(top_left, bottom_right, image_size=None):
+    """Cached GridGeometry for a grid position and capture size."""
+    return GridGeometry(top_left, bottom_right, image_size)
+
+
+def image_geometry(image):
+    """Cached GridGeometry for a bare grid image (no screen position known)."""
+    return grid_geometry((0, 0), (image.shape[1], image.shape[0]))
+
+
+def cell_view(grid_hsv):
+    """View a grid image as (8, cell_h, 8, cell_w, channels) without copying.
+
+    Cells are cell_h = height // 8 by cell_w = width // 8 pixels, exactly as in
+    the per-cell path; leftover rows/columns at the right and bottom are
+    ignored there too. Cell (row, col) is view[row, :, col]. The axes are left
+    in image order (not transposed to (8, 8, h, w)) so that reductions over
+    axes (1, 3) walk memory contiguously.
+    """
+    cell_h = grid_hsv.shape[0] // GRID_SIZE
+    cell_w = grid_hsv.shape[1] // GRID_SIZE
+    cropped = grid_hsv[: cell_h * GRID_SIZE, : cell_w * GRID_SIZE]
+    return cropped.reshape(GRID_SIZE, cell_h, GRID_SIZE, cell_w, -1)
+
+
+def _channel_sums(channel, rows, cols):
+    """Per-cell (full, window) sums of one (8, h, 8, w) channel."""
+    full = channel.sum(axis=(1, 3), dtype=np.int64)
+    window = channel[:, rows, :, cols].sum(axis=(1, 3), dtype=np.int64)
+    return full, window
+
+
+class FrameDiffer:
+    """Per-cell mean absolute difference between two frames, without full-size temporaries.
+
+    Shared by the stability wait and the double-scan check. Each cell is
+    compared with cv2.norm(NORM_L1) on the two uint8 ROIs, a saturating
+    integer |a - b| sum that needs no difference image at all. With stride
+    > 1 (every stride-th pixel per axis) or gray (green channel only), both
+    frames are first reduced into preallocated buffers that are reused on
+    every call. Only the (8, 8) result is allocated per call.
+    """
+
+    def __init__(self, stride=DIFF_STRIDE, gray=DIFF_GRAY):
+        self.stride = stride
+        self.gray = gray
+        self._buffers = {}
+
+    def _buffer(self, key, shape):
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[key] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def _reduce(self, frame, slot):
+        """Cropped (and optionally strided/single-channel) frame. Returns (image, geometry)."""
+        cell_h = frame.shape[0] // GRID_SIZE // self.stride
+        cell_w = frame.shape[1] // GRID_SIZE // self.stride
+        image = frame
+        if self.stride > 1:
+            size = (cell_h * GRID_SIZE, cell_w * GRID_SIZE)
+            image = self._buffer((slot, "strided"), size + frame.shape[2:])
+            cropped = frame[: size[0] * self.stride, : size[1] * self.stride]
+            cv2.resize(cropped, size[::-1], dst=image, interpolation=cv2.INTER_NEAREST)
+        if self.gray and image.ndim == 3:
+            channel = self._buffer((slot, "gray"), image.shape[:2])
+            cv2.extractChannel(image, 1, dst=channel)
+            image = channel
+        return image, grid_geometry((0, 0), (cell_w * GRID_SIZE, cell_h * GRID_SIZE))
+
+    def cell_motion(self, prev_frame, curr_frame):
+        """Per-cell mean absolute pixel difference. Returns an (8, 8) float array.
+
+        The mean over all cells is the whole-frame mean diff (minus any
+        leftover edge pixels).
+        """
+        prev, geometry = self._reduce(prev_frame, 0)
+        curr, _ = self._reduce(curr_frame, 1)
+        motion = np.empty((GRID_SIZE, GRID_SIZE))
+        for row in range(GRID_SIZE):
+            for col in range(GRID_SIZE):
+                cell = geometry.cell_slices[row][col]
+                motion[row, col] = cv2.norm(prev[cell], curr[cell], cv2.NORM_L1)
+        channels = prev.shape[2] if prev.ndim == 3 else 1
+        return motion / (geometry.cell_h * geometry.cell_w * channels)
+
+
+def _masked_median(values, mask):
+    """Median of values[mask] per cell for (8, h, 8, w) uint8 arrays.
+
+    Built from per-cell 256-bin histograms, so it is exact: for an even count
+    it returns the floored mean of the two middle values, like
+    int(np.median(...)). Cells with an empty mask get 0.
+    """
+    n_cells = GRID_SIZE * GRID_SIZE
+    cell_ids = np.arange(n_cells).reshape(GRID_SIZE, 1, GRID_SIZE, 1)
+    bins = (cell_ids * 256 + values)[mask]
+    hist = np.bincount(bins, minlength=n_cells * 256).reshape(n_cells, 256)
+    cdf = np.cumsum(hist, axis=1)
+    counts = cdf[:, -1:]
+    low = (cdf > (counts - 1) // 2).argmax(axis=1)
+    high = (cdf > counts // 2).argmax(axis=1)
+    return ((low + high) // 2).reshape(GRID_SIZE, GRID_SIZE)
+
+
+def _special_hue_checks(cell, geometry, hypercube_candidate):
+    """Per-cell hue statistics for a glowing cell. Returns the special type.
+
+    Same checks as bejeweled.classify_special after its border tests; only
+    run for the few cells whose border is bright enough to be special.
+    """
+    h, s, v = cell[:, :, 0], cell[:, :, 1], cell[:, :, 2]
+    if hypercube_candidate:
+        center = cell[geometry.special_center]
+        ch, cs, cv = center[:, :, 0], center[:, :, 1], center[:, :, 2]
+        bright_mask = (cs > 40) & (cv > 40)
+        if np.count_nonzero(bright_mask) > 10:
+            if float(np.std(ch[bright_mask])) > 35:
+                return "hypercube"
+
+    color_mask = (s > 60) & (v > 60)
+    if np.count_nonzero(color_mask) > 10:
+        if float(np.std(h[color_mask])) > FLAME_HUE_STD_THRESHOLD:
+            return "flame"
+    return "star"
+
+
+def classify_specials(cells, geometry):
+    """Classify all 64 cells as regular/flame/star/hypercube. Returns an (8, 8) array.
+
+    Border brightness and saturation (outer ring outside the center 50%)
+    are computed for every cell at once; cells with dark borders are regular
+    without further work.
+    """
+    rows, cols = geometry.special_center
+    v_full, v_center = _channel_sums(cells[..., 2], rows, cols)
+    s_full, s_center = _channel_sums(cells[..., 1], rows, cols)
+    border_v = (v_full - v_center) / geometry.border_count
+    border_s = (s_full - s_center) / geometry.border_count
+
+    specials = np.full((GRID_SIZE, GRID_SIZE), "regular", dtype=object)
+    glowing = border_v >= SPECIAL_BORDER_V_THRESHOLD
+    hypercube_candidate = (
+        (border_s < HYPERCUBE_BORDER_S_THRESHOLD) & (border_v > HYPERCUBE_BORDER_V_THRESHOLD)
+    )
+    for row, col in zip(*np.nonzero(glowing)):
+        specials[row, col] = _special_hue_checks(
+            cells[row, :, col], geometry, hypercube_candidate[row, col],
+        )
+    return specials
+
+
+def classify_cells(grid_hsv, geometry=None):
+    """Identify gem color and special type for all 64 cells of a grid HSV image.
+
+    Returns a list-of-lists color grid with the same labels as calling
+    bejeweled.identify_cell_color on every cell ('' for unidentified cells).
+    geometry: GridGeometry for this capture size (looked up if omitted).
+    """
+    geometry = geometry or image_geometry(grid_hsv)
+    cells = cell_view(grid_hsv)
+    specials = classify_specials(cells, geometry)
+
+    # Center 50% for color statistics (same bounds as identify_cell_color)
+    rows, cols = geometry.color_center
+    center = cells[:, rows, :, cols]
+    h, s, v = center[..., 0], center[..., 1], center[..., 2]
+    total_pixels = h.shape[1] * h.shape[3]
+
+    color_mask = (s > MIN_SATURATION) & (v > MIN_VALUE)
+    color_pixels = np.count_nonzero(color_mask, axis=(1, 3))
+    white_pixels = np.count_nonzero((s < WHITE_MAX_SAT) & (v > WHITE_MIN_VAL), axis=(1, 3))
+
+    # Special gems (star/flame) have bright glow that creates many false
+    # white pixels — only classify as white if no colored pixels exist.
+    min_pixels = total_pixels * MIN_COLOR_RATIO
+    white = (white_pixels > min_pixels) & (
+        (specials == "regular") | (color_pixels < min_pixels)
+    )
+    colored = ~white & (color_pixels >= min_pixels)
+    hue_names = _HUE_NAMES[_masked_median(h, color_mask)]
+
+    color_grid = [["" for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            special = specials[row, col]
+            if special == "hypercube":
+                color_grid[row][col] = "hypercube"
+                continue
+            if white[row, col]:
+                base = "white"
+            elif colored[row, col]:
+                base = hue_names[row, col]
+            else:
+                continue
+            if special in ("flame", "star"):
+                base = f"{base}_{special}"
+            color_grid[row][col] = base
+    return color_grid
+
+
+@lru_cache(maxsize=8)
+def _sample_index(cell_h, cell_w, side):
+    """Row and column indices of a side x side sample from each of the 8x8 cells.
+
+    Samples sit at the centers of side equal strips of the cell, so the
+    center-50% and border windows of the sampled cell cover the same part of
+    the gem as on the full-resolution cell.
+    """
+    def axis(cell_len):
+        if cell_len <= side:
+            offsets = np.arange(cell_len)
+        else:
+            offsets = (np.arange(side) * 2 + 1) * cell_len // (2 * side)
+        return (np.arange(GRID_SIZE)[:, None] * cell_len + offsets).ravel()
+
+    return axis(cell_h), axis(cell_w)
+
+
+def subsample_grid(grid_img, side=SUBSAMPLE_SIDE):
+    """Strided sample of side x side pixels per cell. Returns an (8*side, 8*side, C) image.
+
+    Taken from the BGR capture before color conversion, so cvtColor and all
+    reductions run on the sample only. Cells already smaller than side are
+    kept whole.
+    """
+    rows, cols = _sample_index(
+        grid_img.shape[0] // GRID_SIZE, grid_img.shape[1] // GRID_SIZE, side,
+    )
+    # Two 1-D takes are several times faster than one 2-D fancy index
+    return grid_img.take(rows, axis=0).take(cols, axis=1)
+
+
+def classify_subsampled(grid_img, side=SUBSAMPLE_SIDE):
+    """Identify all 64 cells from a fixed pixel budget. Returns (color_grid, sample_hsv)."""
+    sample_hsv = cv2.cvtColor(subsample_grid(grid_img, side), cv2.COLOR_BGR2HSV)
+    return classify_cells(sample_hsv), sample_hsv
+
+
+class CellChangeTracker:
+    """Remembers each cell's label and pixels so unchanged cells can be skipped.
+
+    A cell's signature is a strided SIGNATURE_SIDE^2 pixel sample of the raw
+    capture (about 50 us for the whole grid). A cell counts as changed when
+    enough of its sampled pixels moved since the cell was last classified;
+    signatures of unchanged cells are kept, so slow drift still adds up to a
+    change eventually. Counts re-classified cells for the log.
+    """
+
+    def __init__(self):
+        self.signatures = None
+        self.color_grid = None
+        self.grid_hsv = None
+        self.frames = 0
+        self.reclassified = 0
+
+    def changed_cells(self, grid_img):
+        """Return (changed, signatures): an (8, 8) bool mask and the new signatures.
+
+        Every cell is changed when nothing is cached yet or the capture size
+        changed.
+        """
+        signatures = subsample_grid(grid_img, SIGNATURE_SIDE)
+        if self.signatures is None or self.signatures.shape != signatures.shape:
+            return np.ones((GRID_SIZE, GRID_SIZE), dtype=bool), signatures
+        delta = cv2.absdiff(signatures, self.signatures).max(axis=2, keepdims=True)
+        moved = np.count_nonzero(cell_view(delta >= CHANGE_PIXEL_DELTA)[..., 0], axis=(1, 3))
+        return moved >= CHANGE_MIN_PIXELS, signatures
+
+    def update(self, changed, signatures, color_grid, grid_hsv):
+        """Adopt the labels and signatures of the cells that were re-classified."""
+        if self.signatures is None or self.signatures.shape != signatures.shape:
+            self.signatures = signatures.copy()
+        else:
+            rows, cols = np.nonzero(changed)
+            cell_view(self.signatures)[rows, :, cols] = cell_view(signatures)[rows, :, cols]
+        self.color_grid = color_grid
+        self.grid_hsv = grid_hsv
+        self.frames += 1
+        self.reclassified += int(np.count_nonzero(changed))
+
+    def reset(self):
+        """Forget the cached frame (e.g. after the grid moved)."""
+        self.signatures = None
+        self.color_grid = None
+        self.grid_hsv = None
+
+    def stats(self):
+        """Average re-classified cells per frame as a short log string."""
+        if not self.frames:
+            return "no frames"
+        cells = GRID_SIZE * GRID_SIZE
+        return (
+            f"{self.reclassified / self.frames:.1f}/{cells} cells re-classified per frame "
+            f"over {self.frames} frames"
+        )
+
+
+def _classify_cell_image(cell_img, side=None):
+    """Label a single saved cell image by tiling it into a full grid."""
+    grid_img = np.tile(cell_img, (GRID_SIZE, GRID_SIZE, 1))
+    if side is None:
+        return classify_cells(cv2.cvtColor(grid_img, cv2.COLOR_BGR2HSV))[0][0]
+    return classify_subsampled(grid_img, side)[0][0][0]
+
+
+def accuracy_report(library_dir="gem_library", side=SUBSAMPLE_SIDE):
+    """Compare full-resolution and subsampled labels against a labelled cell library.
+
+    The reference set is gem_library/<label>/*.png as written by
+    save_gem_library and corrected with review_gems.py (the mixed snapshot/
+    folder is skipped). Returns {label: Counter(total, full, subsampled,
+    disagree)} where full/subsampled count correct labels.
+    """
+    results = {}
+    for label in sorted(os.listdir(library_dir)):
+        label_dir = os.path.join(library_dir, label)
+        if label == "snapshot" or not os.path.isdir(label_dir):
+            continue
+        counts = Counter()
+        for filename in sorted(os.listdir(label_dir)):
+            if not filename.endswith(".png"):
+                continue
+            cell_img = cv2.imread(os.path.join(label_dir, filename))
+            if cell_img is None:
+                continue
+            full = _classify_cell_image(cell_img)
+            sampled = _classify_cell_image(cell_img, side)
+            counts["total"] += 1
+            counts["full"] += full == label
+            counts["subsampled"] += sampled == label
+            counts["disagree"] += full != sampled
+        if counts:
+            results[label] = counts
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    library = sys.argv[1] if len(sys.argv) > 1 else "gem_library"
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else SUBSAMPLE_SIDE
+    if not os.path.isdir(library):
+        print(f"No reference library at {library}. Run the bot and review_gems.py first.")
+        sys.exit(0)
+
+    report = accuracy_report(library, side)
+    totals = sum(report.values(), Counter())
+    print(f"=== Subsampled recognition ({side}x{side} per cell) vs full resolution ===")
+    print(f"{'label':<18}{'n':>5}{'full':>7}{'sub':>7}{'differ':>8}")
+    for label, counts in report.items():
+        print(
+            f"{label:<18}{counts['total']:>5}{counts['full']:>7}"
+            f"{counts['subsampled']:>7}{counts['disagree']:>8}"
+        )
+    if totals["total"]:
+        print(
+            f"{'all':<18}{totals['total']:>5}{totals['full']:>7}{totals['subsampled']:>7}"
+            f"{totals['disagree']:>8}  (accuracy {totals['full'] / totals['total']:.1%}"
+            f" -> {totals['subsampled'] / totals['total']:.1%})"
+        )
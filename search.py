@@ -0,0 +1,510 @@
+"""
+N-ply move search for BejeweledBot.
+
+Generalizes the fixed 2-step look-ahead of evaluate_move into a search of
+configurable depth. Each ply scores every legal swap of every board on the
+frontier in one batched call to the board engine, then expands only the best
+few children (beam pruning) to the next ply. Depths are searched one after
+another (iterative deepening) under a per-frame time budget, so the search
+always has a complete answer from the last finished depth to fall back on.
+Each depth's root scores order the candidates of the next one, which the
+parallel backend uses to deal the promising candidates evenly to its workers.
+
+By default cleared cells stay empty (no new gems are simulated). With a
+RefillModel the search becomes an expectimax: after each expanded move the
+empty cells are filled with K sampled colors, refill cascades are scored,
+and the move is valued by the average over the K samples.
+
+Planner runs the search on a background thread, so the main loop can start
+planning a grid before the board is confirmed stable and collect the move
+afterwards (or cancel it if the board changed).
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import board
+from board import BOTTOM_ROW_BONUS, GRID_SIZE
+from transposition import TranspositionTable
+
+SEARCH_MAX_DEPTH = 3  # Plies to search when time allows (2 = classic look-ahead)
+SEARCH_BEAM_WIDTH = 8  # Children expanded per board below the root
+SEARCH_TIME_BUDGET_MS = 150  # Per-frame budget; depth 1 always completes
+LOOKAHEAD_DISCOUNT = (2, 3)  # Follow-up plies count 2/3 (numerator, denominator)
+SEARCH_CHUNK_BOARDS = 16  # Boards per batch; the deadline is checked between batches
+
+# Expectimax refill model
+REFILL_SAMPLES = 4  # K sampled refills per expanded move
+REFILL_ROUNDS = 2  # Refill -> cascade rounds simulated per sample
+
+SearchResult = namedtuple("SearchResult", "move score depth nodes elapsed_ms")
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the frame's time budget runs out."""
+
+
+class RefillModel:
+    """Samples the colors of gems that fall in to replace cleared cells.
+
+    probs: probability of each base color in board.BASE_COLORS order. The
+    same K fills are applied to every board of a batch (common random
+    numbers), so candidate moves are compared on identical luck and the
+    sampling is a single vectorized draw per round.
+    """
+
+    def __init__(self, probs=None, samples=REFILL_SAMPLES, rounds=REFILL_ROUNDS, seed=None):
+        n_colors = len(board.BASE_COLORS)
+        self.probs = np.full(n_colors, 1 / n_colors) if probs is None else np.asarray(probs)
+        self.samples = samples
+        self.rounds = rounds
+        self.rng = np.random.default_rng(seed)
+        # Observed odds change from frame to frame, so cached values must not outlive them
+        self._odds_id = hashlib.blake2b(
+            np.asarray(self.probs, dtype=np.float64).tobytes(), digest_size=6
+        ).hexdigest()
+
+    @classmethod
+    def from_board(cls, root, **kwargs):
+        """Build a model whose color odds follow the colors seen on a board."""
+        base = root & board.BASE_MASK
+        counts = np.bincount(base.ravel(), minlength=board.HYPERCUBE + 1)
+        counts = counts[1 : len(board.BASE_COLORS) + 1].astype(float)
+        if not counts.sum():
+            return cls(**kwargs)
+        return cls(counts / counts.sum(), **kwargs)
+
+    @property
+    def key(self):
+        """Short id for transposition table kinds (results depend on the model and its odds)."""
+        return f"r{self.samples}x{self.rounds}_{self._odds_id}"
+
+    def sample(self, boards):
+        """Refill a (M, 8, 8) stack K times. Returns (refilled (M*K, 8, 8), scores).
+
+        scores holds the cascade points earned by the refilled gems; those
+        cascades continue the move's own chain, so they start at level 1.
+        """
+        colors = np.arange(1, len(board.BASE_COLORS) + 1, dtype=np.uint8)
+        refilled = np.repeat(boards, self.samples, axis=0)
+        scores = np.zeros(len(refilled), dtype=np.int64)
+        for _ in range(self.rounds):
+            empty = refilled == board.EMPTY
+            if not empty.any():
+                break
+            fills = self.rng.choice(colors, size=(self.samples, *boards.shape[1:]), p=self.probs)
+            fills = np.tile(fills, (len(boards), 1, 1))
+            round_scores, refilled = board.evaluate_batch(
+                np.where(empty, fills, refilled), cascade_level=1,
+            )
+            scores += round_scores
+        return refilled, scores
+
+
+class _Search:
+    """State for one search call: deadline, node counter and options.
+
+    nodes counts simulated post-swap boards across all plies and depths.
+    """
+
+    def __init__(self, table, beam_width, deadline, refill=None, stop=None):
+        self.table = table
+        self.beam_width = beam_width
+        self.deadline = deadline
+        self.refill = refill
+        self.stop = stop
+        self.nodes = 0
+
+    def check_time(self):
+        """Abort the current depth if the deadline has passed or the search was stopped."""
+        if self.stop is not None and self.stop.is_set():
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+    def expand(self, boards, board_idx, swap_idx, depth):
+        """Score one swap per (board, swap) pair and add discounted child values.
+
+        Returns (totals, expandable): totals is step-1 score plus the
+        discounted value of the resulting board searched depth-1 plies deeper
+        (beam permitting); expandable marks swaps that formed a match, other
+        than hoarded hypercube swaps.
+        """
+        self.check_time()
+        self.nodes += len(swap_idx)
+        step1, resulting = board.score_swaps(boards[board_idx], swap_idx, self.table)
+
+        # Hoarded hypercube swaps keep their last-resort score and are never
+        # expanded; swaps with no immediate match are rejected by the game.
+        hoarded = board.hoarded_swaps(boards[board_idx], swap_idx, step1)
+        expandable = (step1 > 0) & ~hoarded
+        totals = step1.copy()
+        if depth <= 1 or not expandable.any():
+            return totals, expandable
+
+        keep = expandable & self._beam(board_idx, step1, expandable)
+        if keep.any():
+            totals[keep] += self.follow_up(resulting[keep], depth - 1)
+        return totals, expandable
+
+    def follow_up(self, resulting, depth):
+        """Value added after a move: discounted child search, plus refills if modelled.
+
+        Without a refill model this is the discounted value of the resulting
+        board. With one, each board is refilled K times and the refill cascade
+        score plus discounted child value is averaged over the samples.
+        """
+        num, den = LOOKAHEAD_DISCOUNT
+        if self.refill is None:
+            if depth < 1:
+                return np.zeros(len(resulting), dtype=np.int64)
+            return self.values(resulting, depth) * num // den
+
+        self.check_time()
+        refilled, scores = self.refill.sample(resulting)
+        self.nodes += len(refilled)
+        if depth >= 1:
+            scores += self.values(refilled, depth) * num // den
+        return scores.reshape(len(resulting), -1).mean(axis=1).astype(np.int64)
+
+    def _beam(self, board_idx, step1, expandable):
+        """Mark the beam_width best expandable children of each parent board."""
+        if self.beam_width is None:
+            return np.ones(len(step1), dtype=bool)
+        # Sort by parent, then by descending step-1 score (stable on scan order)
+        order = np.lexsort((-np.where(expandable, step1, -1), board_idx))
+        sorted_parents = board_idx[order]
+        first = np.searchsorted(sorted_parents, sorted_parents, side="left")
+        rank = np.arange(len(order)) - first
+        keep = np.zeros(len(step1), dtype=bool)
+        keep[order[rank < self.beam_width]] = True
+        return keep
+
+    def values(self, boards, depth):
+        """Best achievable discounted score on each board, searching depth plies.
+
+        Depth 1 is the classic follow-up search (best single swap), cached
+        under the same table entries as board.best_next_scores.
+        """
+        kind = board.TT_NEXT if depth == 1 else f"value_d{depth}_b{self.beam_width}"
+        if depth > 1 and self.refill is not None:
+            kind += "_" + self.refill.key
+        if self.table is None:
+            return self._values(boards, depth)
+        keys, values, miss_idx = self.table.lookup_batch(kind, boards)
+        if miss_idx.size:
+            computed = self._values(boards[miss_idx], depth).tolist()
+            self.table.store_batch(kind, keys, values, miss_idx, computed)
+        return np.array(values, dtype=np.int64)
+
+    def _values(self, boards, depth):
+        best = np.zeros(len(boards), dtype=np.int64)
+        for start in range(0, len(boards), SEARCH_CHUNK_BOARDS):
+            chunk = boards[start : start + SEARCH_CHUNK_BOARDS]
+            board_idx, swap_idx = np.nonzero(board.legal_swap_mask(chunk))
+            if board_idx.size:
+                totals, _ = self.expand(chunk, board_idx, swap_idx, depth)
+                np.maximum.at(best, board_idx + start, totals)
+        return best
+
+
+def _root_scores(search, root, candidates, depth):
+    """Score every root candidate searching depth plies. Returns an (N,) array."""
+    # The root ranks every candidate, so only plies below it are beam-pruned
+    boards = np.repeat(root[None], len(candidates), axis=0)
+    search.check_time()
+    search.nodes += len(candidates)
+    step1, resulting = board.score_swaps(boards, candidates, search.table)
+
+    expand = (step1 > 0) & ~board.hoarded_swaps(boards, candidates, step1)
+    totals = step1.copy()
+    if expand.any():
+        bonus = board.swap_rows(candidates[expand]) * BOTTOM_ROW_BONUS
+        totals[expand] += bonus + search.follow_up(resulting[expand], depth - 1)
+    return totals
+
+
+def root_candidates(root, failed_moves=None):
+    """Legal swaps on the root board (SWAPS indices), minus blacklisted moves."""
+    failed_moves = failed_moves or set()
+    return np.array([
+        idx for idx in np.flatnonzero(board.legal_swap_mask(root))
+        if board.MOVES[idx] not in failed_moves
+    ], dtype=np.intp)
+
+
+def _deepen(score_depth, candidates, max_depth, deadline):
+    """Iterative deepening loop shared by the serial and parallel searches.
+
+    score_depth(depth, deadline, previous) returns root scores for that depth
+    (previous: the scores of the depth before, or None) or raises
+    SearchTimeout. Returns (move, score, completed_depth).
+    """
+    best_move, best_score, completed = None, 0, 0
+    scores = None
+    for depth in range(1, max_depth + 1):
+        # Depth 1 is exempt from the budget; deeper plies honour it
+        try:
+            scores = score_depth(depth, deadline if depth > 1 else None, scores)
+        except SearchTimeout:
+            break
+        completed = depth
+        best = int(np.argmax(scores))
+        best_move, best_score = None, 0
+        if scores[best] > 0:
+            best_move, best_score = board.MOVES[candidates[best]], int(scores[best])
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+    return best_move, best_score, completed
+
+
+def search_move(color_grid, failed_moves=None, table=None,
+                max_depth=SEARCH_MAX_DEPTH, beam_width=SEARCH_BEAM_WIDTH,
+                time_budget_ms=SEARCH_TIME_BUDGET_MS, refill=None, stop=None):
+    """Find the best move with iterative deepening. Returns a SearchResult.
+
+    Searches depth 1, 2, ... max_depth in turn and keeps the best move of the
+    deepest depth that finished inside time_budget_ms (None = no limit).
+    Depth 1 always runs to completion so there is always an answer. With
+    max_depth=2 and no refill model the scores equal board.find_optimal_move.
+    refill: optional RefillModel; moves are then scored by expected value
+    over sampled refills of the cleared cells. stop: optional
+    threading.Event that abandons the search when set (even at depth 1,
+    which may then leave no move).
+    """
+    start = time.perf_counter()
+    root = color_grid if isinstance(color_grid, np.ndarray) else board.encode_grid(color_grid)
+    candidates = root_candidates(root, failed_moves)
+    if not candidates.size:
+        return SearchResult(None, 0, 0, 0, (time.perf_counter() - start) * 1000)
+
+    search = _Search(table, beam_width, None, refill, stop)
+
+    def score_depth(depth, deadline, _previous):
+        search.deadline = deadline
+        return _root_scores(search, root, candidates, depth)
+
+    deadline = None if time_budget_ms is None else start + time_budget_ms / 1000
+    move, score, completed = _deepen(score_depth, candidates, max_depth, deadline)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return SearchResult(move, score, completed, search.nodes, elapsed_ms)
+
+
+# Per-process state of ParallelSearch workers: a transposition table that
+# persists across frames, and the game it belongs to.
+_worker_table = None
+_worker_game = None
+
+
+def _init_worker():
+    """Process pool initializer: give each worker its own transposition table."""
+    global _worker_table  # pylint: disable=global-statement
+    _worker_table = TranspositionTable()
+
+
+def _worker_root_scores(root_bytes, candidates, depth, beam_width, budget_ms, refill, game):
+    """Score a slice of root candidates in a worker process.
+
+    root_bytes is the 64-byte board. Returns (scores, nodes), or (None, nodes)
+    if the worker ran out of time.
+    """
+    global _worker_game  # pylint: disable=global-statement
+    if game != _worker_game:
+        _worker_table.clear()
+        _worker_game = game
+    deadline = None if budget_ms is None else time.perf_counter() + budget_ms / 1000
+    root = np.frombuffer(root_bytes, dtype=np.uint8).reshape(GRID_SIZE, GRID_SIZE)
+    search = _Search(_worker_table, beam_width, deadline, refill)
+    try:
+        scores = _root_scores(search, root, candidates, depth)
+    except SearchTimeout:
+        return None, search.nodes
+    return scores, search.nodes
+
+
+class ParallelSearch:
+    """Opt-in search backend that spreads root candidates over a process pool.
+
+    Move search is pure CPU work, so threads serialize on the GIL; separate
+    processes don't. The pool is created once and reused for every frame.
+    Depth 1 runs locally (it is cheaper than a round trip); deeper plies
+    deal the root candidates round-robin to the workers, best scores of the
+    depth before first, so each worker gets a similar share of the
+    candidates worth expanding. Each searches its share with its own
+    transposition table. Boards are sent as 64-byte strings rather than
+    pickled lists of color names.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.game = 0
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+        )
+
+    def new_game(self):
+        """Tell the workers to drop their cached results on their next task."""
+        self.game += 1
+
+    def shutdown(self):
+        """Cancel pending work and wait for the worker processes to exit.
+
+        Not waiting leaves the pool's queue thread writing to closed pipes at
+        interpreter exit (OSError: Bad file descriptor).
+        """
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def search_move(self, color_grid, failed_moves=None, table=None,
+                    max_depth=SEARCH_MAX_DEPTH, beam_width=SEARCH_BEAM_WIDTH,
+                    time_budget_ms=SEARCH_TIME_BUDGET_MS, refill=None):
+        """Same contract as search_move, with depths 2+ searched in parallel.
+
+        table is only used for the local depth-1 pass; workers keep their own.
+        """
+        start = time.perf_counter()
+        root = color_grid if isinstance(color_grid, np.ndarray) else board.encode_grid(color_grid)
+        candidates = root_candidates(root, failed_moves)
+        if not candidates.size:
+            return SearchResult(None, 0, 0, 0, (time.perf_counter() - start) * 1000)
+
+        local = _Search(table, beam_width, None, refill)
+        nodes = [0]
+        root_bytes = root.tobytes()
+        n_slices = min(self.workers, len(candidates))
+
+        def score_depth(depth, deadline, previous):
+            if depth == 1:
+                return _root_scores(local, root, candidates, depth)
+            budget_ms = None
+            if deadline is not None:
+                budget_ms = (deadline - time.perf_counter()) * 1000
+            order = np.argsort(-previous, kind="stable")
+            slices = [order[i::n_slices] for i in range(n_slices)]
+            futures = [
+                self._pool.submit(
+                    _worker_root_scores, root_bytes, candidates[part],
+                    depth, beam_width, budget_ms, refill, self.game,
+                )
+                for part in slices
+            ]
+            timeout = None if budget_ms is None else max(budget_ms, 0) / 1000
+            done, pending = concurrent.futures.wait(futures, timeout=timeout)
+            for future in pending:
+                future.cancel()
+            scores = np.zeros(len(candidates), dtype=np.int64)
+            for i, future in enumerate(futures):
+                if future not in done:
+                    raise SearchTimeout
+                part, part_nodes = future.result()
+                nodes[0] += part_nodes
+                if part is None:
+                    raise SearchTimeout
+                scores[slices[i]] = part
+            return scores
+
+        deadline = None if time_budget_ms is None else start + time_budget_ms / 1000
+        move, score, completed = _deepen(score_depth, candidates, max_depth, deadline)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return SearchResult(move, score, completed, local.nodes + nodes[0], elapsed_ms)
+
+
+class Planner:
+    """Runs search_move on a background thread, so planning overlaps waiting.
+
+    submit() starts searching a board as soon as its grid is recognized,
+    possibly before the board is confirmed stable; submitting another board
+    (or set of excluded moves) cancels the search in progress. commit()
+    collects the result for the board finally confirmed, waiting for the
+    search to finish within its time budget. cancel() abandons it when the
+    board changed under it. The main thread mostly sleeps or captures while
+    the planner works, and sleeping releases the GIL.
+
+    Only the planner thread searches between submit() and commit()/cancel(),
+    so the transposition table is never used from two threads at once.
+    profiler: optional timing.FrameProfiler; searches run inside its
+    thread_profile(), so a running profile covers the planner thread too.
+    """
+
+    def __init__(self, profiler=None):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="planner",
+        )
+        self._key = None
+        self._future = None
+        self._stop = None
+        self.profiler = profiler
+        self.submitted = 0
+        self.committed = 0
+        self.cancelled = 0
+        self.search_ms = 0.0  # Search time of committed plans
+        self.wait_ms = 0.0  # Time commit() spent waiting for them
+
+    @staticmethod
+    def _plan_key(root, failed_moves):
+        return root.tobytes(), frozenset(failed_moves or ())
+
+    def submit(self, root, failed_moves=None, table=None, refill=None, **kwargs):
+        """Start searching root (an encoded board) unless it is already being planned.
+
+        Takes search_move's other arguments. Returns True if a new search started.
+        """
+        key = self._plan_key(root, failed_moves)
+        if self._future is not None and key == self._key:
+            return False
+        self.cancel()
+        self._key = key
+        self._stop = threading.Event()
+        self._future = self._executor.submit(
+            self._search, root.copy(), set(key[1]), table, refill=refill, stop=self._stop, **kwargs
+        )
+        self.submitted += 1
+        return True
+
+    def _search(self, *args, **kwargs):
+        profile = self.profiler.thread_profile() if self.profiler else contextlib.nullcontext()
+        with profile:
+            return search_move(*args, **kwargs)
+
+    def commit(self, root, failed_moves=None):
+        """SearchResult of the plan for root, or None if a different board was planned."""
+        if self._future is None or self._plan_key(root, failed_moves) != self._key:
+            return None
+        start = time.perf_counter()
+        result = self._future.result()
+        self.wait_ms += (time.perf_counter() - start) * 1000
+        self.search_ms += result.elapsed_ms
+        self.committed += 1
+        self._key = self._future = None
+        return result
+
+    def cancel(self):
+        """Abandon the plan in progress, waiting for the search to notice."""
+        if self._future is None:
+            return
+        self._stop.set()
+        self._future.result()
+        self.cancelled += 1
+        self._key = self._future = None
+
+    def shutdown(self):
+        """Cancel any plan and stop the planner thread."""
+        self.cancel()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Plans started/committed/cancelled and the search time hidden, as a log string."""
+        if not self.committed:
+            return f"{self.submitted} plans, none committed"
+        hidden = 1 - self.wait_ms / max(self.search_ms, 1e-9)
+        return (
+            f"{self.submitted} plans, {self.committed} committed, {self.cancelled} cancelled; "
+            f"search {self.search_ms / self.committed:.1f}ms per move, "
+            f"{self.wait_ms / self.committed:.1f}ms waited ({max(hidden, 0):.0%} hidden)"
+        )
@@ -0,0 +1,223 @@
+"""
+Binary session recording for BejeweledBot.
+
+The playthrough logs keep grids as format_grid text at DEBUG level, which is
+bulky and slow to parse back. A session file instead stores one binary
+record per scanned frame: a fixed-size header (timestamp, integer-coded
+grid, chosen move, score, stage timings) followed by the frame as a PNG.
+SessionReader memory-maps the file and exposes all headers as one NumPy
+structured array, so thousands of frames can be analysed without decoding a
+single image; frames are decoded only when asked for.
+
+    python session.py <session.bjs>    # summary of a recorded session
+
+File layout: MAGIC, a uint32 length, a JSON header (record layout, stage
+names, cell code table), then the records back to back.
+"""
+
+import json
+import mmap
+import struct
+
+import cv2
+import numpy as np
+
+import board
+from board import GRID_SIZE
+from timing import STAGES
+
+MAGIC = b"BJSESS1\0"
+SESSION_EXT = ".bjs"  # Session files are recognised by this extension
+FRAME_FORMAT = ".png"  # Frame encoding (lossless, so replays classify like live play)
+PNG_COMPRESSION = 1  # Fast PNG level: recording must not slow the main loop
+NO_MOVE = (-1, -1, -1, -1)
+
+
+def record_dtype(stages=STAGES):
+    """Structured dtype of one record header (the frame bytes follow it)."""
+    return np.dtype(
+        [
+            ("timestamp", "<f8"),
+            ("game", "<u2"),
+            ("grid", "u1", (GRID_SIZE, GRID_SIZE)),
+            ("move", "i1", (4,)),
+            ("score", "<i4"),
+            ("timings", "<f4", (len(stages),)),
+            ("frame_len", "<u4"),
+        ]
+    )
+
+
+class SessionWriter:
+    """Appends per-frame records to a new session file."""
+
+    def __init__(self, path, stages=STAGES):
+        self.path = path
+        self.stages = tuple(stages)
+        self.dtype = record_dtype(self.stages)
+        self.count = 0
+        self._record = np.zeros(1, dtype=self.dtype)
+        header = json.dumps(
+            {
+                "version": 1,
+                "stages": self.stages,
+                "frame_format": FRAME_FORMAT,
+                "codes": {str(code): name for code, name in board.CODE_TO_NAME.items()},
+            }
+        ).encode()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def append(self, timestamp, frame=None, grid=None, move=None, score=0, timings=None,
+               game=1):
+        """Write one record.
+
+        frame: BGR image, or None to store no frame. grid: (8, 8) board codes
+        or a color-name grid. move: (r1, c1, r2, c2) or None. timings: dict of
+        stage name -> seconds; missing stages are stored as NaN.
+        """
+        encoded = b""
+        if frame is not None:
+            ok, buf = cv2.imencode(
+                FRAME_FORMAT, frame, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+            )
+            if ok:
+                encoded = buf.tobytes()
+        record = self._record[0]
+        record["timestamp"] = timestamp
+        record["game"] = game
+        if grid is None:
+            record["grid"] = board.EMPTY
+        else:
+            codes = np.asarray(grid) if isinstance(grid, np.ndarray) else board.encode_grid(grid)
+            record["grid"] = codes
+        record["move"] = move if move is not None else NO_MOVE
+        record["score"] = score
+        timings = timings or {}
+        record["timings"] = [timings.get(stage, np.nan) * 1000 for stage in self.stages]
+        record["frame_len"] = len(encoded)
+        self._file.write(self._record.tobytes())
+        self._file.write(encoded)
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionReader:
+    """Memory-mapped reader of a session file.
+
+    records: structured array of all record headers (timestamp, game, grid,
+    move, score, timings, frame_len), ready for vectorized analysis.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a session file")
+        (header_len,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._map[start : start + header_len])
+        self.stages = tuple(self.header["stages"])
+        self.dtype = record_dtype(self.stages)
+        self.codes = {int(code): name for code, name in self.header["codes"].items()}
+        self.records, self._frame_offsets = self._index(start + header_len)
+
+    def _index(self, offset):
+        """Walk the records once: gather their headers and frame offsets."""
+        size = len(self._map)
+        stride = self.dtype.itemsize
+        len_offset = self.dtype.fields["frame_len"][1]
+        header_offsets = []
+        while offset + stride <= size:
+            (frame_len,) = struct.unpack_from("<I", self._map, offset + len_offset)
+            if offset + stride + frame_len > size:
+                break  # Truncated last record (recorder was killed mid-write)
+            header_offsets.append(offset)
+            offset += stride + frame_len
+        header_offsets = np.array(header_offsets, dtype=np.int64)
+        if not len(header_offsets):
+            return np.zeros(0, dtype=self.dtype), header_offsets
+        raw = np.frombuffer(self._map, dtype=np.uint8)
+        records = raw[header_offsets[:, None] + np.arange(stride)].view(self.dtype).reshape(-1)
+        return records, header_offsets + stride
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    def timing(self, stage):
+        """Milliseconds spent in stage for every record (NaN where not measured)."""
+        return self.records["timings"][:, self.stages.index(stage)]
+
+    def color_grid(self, index):
+        """Color-name grid of a record, as build_color_grid returns it."""
+        return [[self.codes.get(int(c), "") for c in row] for row in self.records["grid"][index]]
+
+    def frame_bytes(self, index):
+        """Encoded frame of a record, as a zero-copy view into the file (may be empty)."""
+        start = self._frame_offsets[index]
+        length = int(self.records["frame_len"][index])
+        return np.frombuffer(self._map, dtype=np.uint8, count=length, offset=int(start))
+
+    def frame(self, index):
+        """Decoded BGR frame of a record, or None if it was recorded without one."""
+        encoded = self.frame_bytes(index)
+        if not len(encoded):
+            return None
+        return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    def summary(self):
+        """Frame count, moves, games and mean stage timings as text."""
+        records = self.records
+        if not len(records):
+            return "empty session"
+        moves = int((records["move"][:, 0] >= 0).sum())
+        duration = float(records["timestamp"][-1] - records["timestamp"][0])
+        lines = [
+            f"{len(records)} frames, {moves} moves, {len(np.unique(records['game']))} game(s), "
+            f"{duration:.1f}s, {int(records['frame_len'].sum()) / 1e6:.1f} MB of frames"
+        ]
+        for stage in self.stages:
+            times = self.timing(stage)
+            times = times[~np.isnan(times)]
+            if len(times):
+                lines.append(
+                    f"  {stage}: mean {times.mean():.1f}ms, p90 {np.percentile(times, 90):.1f}ms"
+                )
+        return "\n".join(lines)
+
+    def close(self):
+        """Unmap the file (records stay usable; frame views must be released first)."""
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python session.py <session.bjs>")
+        sys.exit(1)
+    with SessionReader(sys.argv[1]) as reader:
+        print(reader.summary())
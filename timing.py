@@ -0,0 +1,232 @@
+"""
+Per-stage latency instrumentation for BejeweledBot's main loop.
+
+Each stage of an iteration (stability wait, capture, recognition, gem
+library, overlay, move search or the wait for the pipelined planner's plan,
+double-scan, move) runs inside
+StageTimer.stage(), which adds its duration to the current frame's row and
+to a rolling window per stage. From those the timer builds a periodic
+one-line summary (moves per minute and each stage's share of loop time) and
+a full report with latency histograms. Raw rows can also be dumped to CSV or
+JSONL to find the stage that limits throughput on a given machine.
+
+FrameProfiler goes one level deeper when that is not enough: it runs cProfile
+over the next N iterations of a live session, including work handed to the
+planner thread, and saves a .prof file.
+"""
+
+import cProfile
+import csv
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+STAGES = (
+    "stability",
+    "capture",
+    "recognition",
+    "gem_library",
+    "overlay",
+    "search",
+    "plan_wait",  # Pipelined search: commit() waiting for the planner thread
+    "double_scan",
+    "move",
+)
+TIMING_WINDOW = 500  # Samples per stage kept for the rolling statistics
+TIMING_SUMMARY_INTERVAL = 60.0  # Seconds between periodic summary log lines
+TIMING_BINS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # Histogram bin edges (ms)
+PROFILE_FRAMES = 50  # Main loop iterations covered by one profile
+PROFILE_DIR = "profiles"  # Where .prof files are written
+
+
+class StageTimer:
+    """Times the stages of each main loop iteration.
+
+    dump_path: optional .csv or .jsonl file receiving one row per frame
+    (seconds per stage; stages that did not run are left empty).
+    """
+
+    def __init__(self, dump_path=None, window=TIMING_WINDOW):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.frame = {}  # stage -> seconds in the current iteration
+        self.frames = 0
+        self._interval_start = time.time()
+        self._interval_moves = 0
+        self._interval_totals = defaultdict(float)
+        self._dump = None
+        self._writer = None
+        if dump_path:
+            self._dump = open(dump_path, "w", newline="")
+            if dump_path.endswith(".csv"):
+                self._writer = csv.writer(self._dump)
+                self._writer.writerow(("frame", "timestamp") + STAGES)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name (also when it exits via continue)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.frame[name] = self.frame.get(name, 0.0) + seconds
+        self.samples[name].append(seconds)
+        self._interval_totals[name] += seconds
+
+    def new_frame(self):
+        """Close the current iteration's row (dumping it) and start the next."""
+        if self.frame:
+            self.frames += 1
+            self._write_row()
+        self.frame = {}
+
+    def _write_row(self):
+        if self._dump is None:
+            return
+        if self._writer:
+            self._writer.writerow(
+                [self.frames, f"{time.time():.3f}"]
+                + [f"{self.frame[s]:.6f}" if s in self.frame else "" for s in STAGES]
+            )
+        else:
+            row = {"frame": self.frames, "timestamp": round(time.time(), 3)}
+            row.update({s: round(v, 6) for s, v in self.frame.items()})
+            self._dump.write(json.dumps(row) + "\n")
+
+    def periodic_summary(self, move_count):
+        """Summary line for the interval just ended, or None if it isn't due yet.
+
+        move_count: total moves so far (moves per minute covers this interval).
+        """
+        elapsed = time.time() - self._interval_start
+        if elapsed < TIMING_SUMMARY_INTERVAL:
+            return None
+        moves = move_count - self._interval_moves
+        parts = [f"{moves / elapsed * 60:.1f} moves/min"]
+        for name in STAGES:
+            if name in self._interval_totals:
+                samples = self.samples[name]
+                parts.append(
+                    f"{name} {self._interval_totals[name] / elapsed * 100:.0f}% "
+                    f"(p50 {np.median(samples) * 1000:.0f}ms)"
+                )
+        self._interval_start = time.time()
+        self._interval_moves = move_count
+        self._interval_totals.clear()
+        return " | ".join(parts)
+
+    def report(self):
+        """Rolling-window latency per stage with histograms, as log text."""
+        edges = ", ".join(f"<{b}" for b in TIMING_BINS_MS)
+        lines = [f"Stage latencies (last {TIMING_WINDOW} samples; bins ms: {edges}, more):"]
+        bins = np.array((0,) + TIMING_BINS_MS + (np.inf,)) / 1000
+        for name in STAGES:
+            samples = np.array(self.samples.get(name, ()))
+            if not len(samples):
+                continue
+            counts, _ = np.histogram(samples, bins)
+            lines.append(
+                f"  {name}: n={len(samples)} mean {samples.mean() * 1000:.1f}ms "
+                f"p50 {np.percentile(samples, 50) * 1000:.1f}ms "
+                f"p90 {np.percentile(samples, 90) * 1000:.1f}ms "
+                f"max {samples.max() * 1000:.1f}ms"
+            )
+            lines.append("    " + " ".join(str(c) for c in counts))
+        return "\n".join(lines)
+
+    def close(self):
+        self.new_frame()
+        if self._dump is not None:
+            self._dump.close()
+            self._dump = None
+
+
+class FrameProfiler:
+    """cProfile over a number of main loop iterations, started at any time.
+
+    The .prof files open in the standard tools (python -m pstats, snakeviz,
+    gprof2dot) and are named after the game and move the profile started at.
+    cProfile only sees the thread that enabled it; other threads wrap their
+    work in thread_profile() to be merged into the saved profile.
+    """
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self._profile = None
+        self._remaining = 0
+        self._frames = 0
+        self._tag = None
+        self._lock = threading.Lock()
+        self._thread_profiles = []  # Finished thread_profile() runs of this profile
+
+    @property
+    def active(self):
+        return self._profile is not None
+
+    def start(self, frames, game, move):
+        """Profile the next frames iterations. Returns False if a profile is already running."""
+        if self.active:
+            return False
+        self._tag = f"game{game}_move{move}"
+        self._remaining = self._frames = frames
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return True
+
+    def frame_done(self):
+        """Count one finished iteration. Returns the .prof path when the profile completes."""
+        if not self.active:
+            return None
+        self._remaining -= 1
+        if self._remaining > 0:
+            return None
+        return self.stop()
+
+    def stop(self):
+        """End the running profile early or on schedule and save it. Returns its path."""
+        if not self.active:
+            return None
+        self._profile.disable()
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+            self._thread_profiles = []
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        done = self._frames - max(self._remaining, 0)
+        path = os.path.join(self.directory, f"profile_{stamp}_{self._tag}_{done}frames.prof")
+        stats.dump_stats(path)
+        self._profile = None
+        return path
+
+    @contextmanager
+    def thread_profile(self):
+        """Profile the calling thread for the body, if a profile is running.
+
+        The run is merged into the saved profile when it finishes before
+        stop(); runs still going then are dropped.
+        """
+        profile = cProfile.Profile() if self.active else None
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:  # Python 3.12+: the running profile already sees every thread
+                profile = None
+        runs = self._thread_profiles
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    runs.append(profile)
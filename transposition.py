@@ -0,0 +1,106 @@
+"""
+Transposition table for BejeweledBot's move search.
+
+Look-ahead keeps re-simulating boards it has already seen: the same
+post-swap board shows up from several move orders, and consecutive frames of
+a game share most of their structure. This module keys board results by a
+64-bit Zobrist hash over the cell codes and keeps them in a bounded,
+LRU-evicted table that lives for a whole game.
+"""
+
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from board import EMPTY, GRID_SIZE
+
+TT_MAX_ENTRIES = 100_000  # ~20 MB of cached board results
+ZOBRIST_SEED = 0x5EED  # Fixed seed so hashes are reproducible between runs
+
+# One random 64-bit key per (cell, code). Empty cells contribute nothing, so
+# a board's hash only depends on the gems actually on it.
+_ZOBRIST = np.random.default_rng(ZOBRIST_SEED).integers(
+    0, np.iinfo(np.uint64).max, size=(GRID_SIZE * GRID_SIZE, 256), dtype=np.uint64,
+)
+_ZOBRIST[:, EMPTY] = 0
+_CELLS = np.arange(GRID_SIZE * GRID_SIZE)
+
+
+def zobrist_hash(boards):
+    """Hash one (8, 8) board or a (N, 8, 8) stack. Returns a uint64 or (N,) array."""
+    codes = boards.reshape(*boards.shape[:-2], GRID_SIZE * GRID_SIZE)
+    return np.bitwise_xor.reduce(_ZOBRIST[_CELLS, codes], axis=-1)
+
+
+class TranspositionTable:
+    """Bounded LRU cache of board results keyed by (kind, Zobrist hash).
+
+    The kinds of entry (cascade results, follow-up scores) are chosen by the
+    board engine; hits and misses are counted per kind so the hit rate of each
+    can be logged. Meant to be created once per game and passed to every
+    search call.
+    """
+
+    def __init__(self, max_entries=TT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, key):
+        """Return the cached value for (kind, key), or None on a miss."""
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            self.misses[kind] += 1
+            return None
+        self._entries.move_to_end((kind, key))
+        self.hits[kind] += 1
+        return entry
+
+    def put(self, kind, key, value):
+        """Store a value, evicting the least recently used entry when full."""
+        self._entries[(kind, key)] = value
+        self._entries.move_to_end((kind, key))
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup_batch(self, kind, boards, salt=None):
+        """Look up every board of a stack. Returns (keys, values, miss_idx).
+
+        values is a list with the cached value per board (None for misses);
+        miss_idx holds the positions the caller still has to compute and
+        hand back through store_batch. salt: optional (N,) uint64 keys XORed
+        into the hashes, for results that depend on more than the board.
+        """
+        keys = zobrist_hash(boards)
+        if salt is not None:
+            keys = keys ^ salt
+        keys = keys.tolist()
+        values = [self.get(kind, key) for key in keys]
+        miss_idx = np.array([i for i, v in enumerate(values) if v is None], dtype=np.intp)
+        return keys, values, miss_idx
+
+    def store_batch(self, kind, keys, values, miss_idx, computed):
+        """Fill the misses from lookup_batch with freshly computed values."""
+        for i, value in zip(miss_idx.tolist(), computed):
+            values[i] = value
+            self.put(kind, keys[i], value)
+        return values
+
+    def clear(self):
+        """Drop all entries and reset the counters (e.g. on a new game)."""
+        self._entries.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self):
+        """Summarize size and per-kind hit rates as a short log string."""
+        parts = [f"{len(self._entries)}/{self.max_entries} entries"]
+        for kind in sorted(self.hits.keys() | self.misses.keys()):
+            total = self.hits[kind] + self.misses[kind]
+            rate = self.hits[kind] / total if total else 0.0
+            parts.append(f"{kind} {self.hits[kind]}/{total} hits ({rate:.0%})")
+        return ", ".join(parts)